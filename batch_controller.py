@@ -0,0 +1,104 @@
+import time
+
+
+def parse_batch_sizes(value):
+    return sorted({int(e) for e in str(value).split(",") if e.strip()})
+
+
+class AdaptiveBatchController:
+    # switches settings.batch_size between warmed sizes. for every candidate it
+    # estimates output fps and end to end latency from the measured inference
+    # time and ingest rate, then picks the highest fps under target_latency,
+    # preferring the lower latency when the fps is the same.
+    def __init__(self, settings, interval=2.0, smoothing=0.2):
+        self.settings = settings
+        self.batch_sizes = parse_batch_sizes(settings.adaptive_batch_sizes)
+        self.target_latency = settings.target_latency
+        self.interval = interval
+        self.smoothing = smoothing
+
+        self.infer_time = {}  # batch size -> smoothed seconds per batch
+        self.ingest_fps = 0
+        self.latency_error = 0  # smoothed measured minus estimated latency
+        self.frames = 0
+        self.window_start = time.time()
+        self.last_change = time.time()
+
+    def smooth(self, old, new):
+        if old is None:
+            return new
+        return old + self.smoothing * (new - old)
+
+    # called by the ingest side for every received frame
+    def observe_frame(self):
+        self.frames += 1
+
+    def observe_batch(self, batch_size, duration):
+        self.infer_time[batch_size] = self.smooth(
+            self.infer_time.get(batch_size), duration
+        )
+
+    def observe_latency(self, latency):
+        estimate = self.estimate(self.settings.batch_size)
+        if estimate is not None:
+            error = latency - estimate[1]
+            self.latency_error = self.smooth(self.latency_error, error)
+
+    def update_ingest_rate(self):
+        cur_time = time.time()
+        elapsed = cur_time - self.window_start
+        if elapsed < self.interval:
+            return
+        fps = self.frames / elapsed
+        self.ingest_fps = self.smooth(self.ingest_fps or None, fps)
+        self.frames = 0
+        self.window_start = cur_time
+
+    def estimate_infer_time(self, batch_size):
+        if batch_size in self.infer_time:
+            return self.infer_time[batch_size]
+        if not self.infer_time:
+            return None
+        # scale the per frame time of the closest measured size
+        nearest = min(self.infer_time, key=lambda b: abs(b - batch_size))
+        return self.infer_time[nearest] * batch_size / nearest
+
+    def estimate(self, batch_size):
+        infer_time = self.estimate_infer_time(batch_size)
+        if infer_time is None:
+            return None
+        capacity = batch_size / infer_time
+        if not self.ingest_fps:
+            return capacity, infer_time + self.latency_error
+        fps = min(self.ingest_fps, capacity)
+        latency = batch_size / self.ingest_fps + infer_time
+        if capacity < self.ingest_fps:
+            latency += infer_time  # a full batch is always waiting
+        return fps, latency + self.latency_error
+
+    def choose(self):
+        best = self.settings.batch_size
+        best_score = None
+        for batch_size in self.batch_sizes:
+            estimate = self.estimate(batch_size)
+            if estimate is None:
+                continue
+            fps, latency = estimate
+            score = (latency <= self.target_latency, round(fps, 1), -latency)
+            if best_score is None or score > best_score:
+                best, best_score = batch_size, score
+        return best
+
+    def update(self):
+        self.update_ingest_rate()
+        cur_time = time.time()
+        if cur_time - self.last_change < self.interval:
+            return
+        batch_size = self.choose()
+        if batch_size != self.settings.batch_size:
+            print(
+                f"Adaptive batch size {self.settings.batch_size} -> {batch_size}",
+                f"(ingest {self.ingest_fps:.1f}fps)",
+            )
+            self.settings.batch_size = batch_size
+            self.last_change = cur_time
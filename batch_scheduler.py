@@ -0,0 +1,121 @@
+from collections import deque
+import time
+import torch
+from warmup_spec import WarmupSpec
+from metrics import STAGE_SECONDS
+from tracing import TRACER
+
+
+class BatchScheduler:
+    # fills each batch round robin across sessions, so several slow clients
+    # share one batch instead of each waiting to fill batch_size alone.
+    # steps and strength apply to a whole batch, so frames only share a batch
+    # with frames of the same resolution, steps and strength. every such group
+    # fills and flushes its own batches.
+    def __init__(self, settings, emit, warmup=None):
+        self.settings = settings
+        self.warmup = warmup if warmup is not None else WarmupSpec.from_settings(settings)
+        self.emit = emit
+        self.pending = {}  # group -> session id -> deque of (image, frame)
+        self.order = {}  # group -> session ids in round robin order
+        self.counts = {}  # group -> frames pending
+
+    @staticmethod
+    def group_key(img, frame):
+        height, width = img.shape[-2:]
+        settings = frame.settings
+        return height, width, settings.num_inference_steps, settings.strength
+
+    def add(self, session_id, img, frame):
+        group = self.group_key(img, frame)
+        sessions = self.pending.setdefault(group, {})
+        if session_id not in sessions:
+            sessions[session_id] = deque()
+            self.order.setdefault(group, deque()).append(session_id)
+        frame.queued = time.time()
+        sessions[session_id].append((img, frame))
+        self.counts[group] = self.counts.get(group, 0) + 1
+        batch_size = self.batch_size(group)
+        while self.counts.get(group, 0) >= batch_size:
+            self.flush(group, batch_size)
+
+    def remove(self, session_id):
+        for group in list(self.pending):
+            frames = self.pending[group].pop(session_id, None)
+            if frames is None:
+                continue
+            self.counts[group] -= len(frames)
+            self.order[group].remove(session_id)
+            if not self.pending[group]:
+                del self.pending[group], self.order[group], self.counts[group]
+
+    # settings.batch_size (which may change at runtime) snapped to a batch
+    # size warm at this resolution, so no shape is recompiled mid stream
+    def batch_size(self, group):
+        batch_size = self.warmup.batch_size_for(self.settings.batch_size, *group[:2])
+        return max(batch_size, 1)  # below 1 the flush loop in add() never ends
+
+    def oldest(self, group):
+        return min(
+            (frames[0][1].received for frames in self.pending[group].values() if frames),
+            default=None,
+        )
+
+    # flush a partial batch once its oldest frame waited max_batch_wait
+    def poll(self):
+        max_wait = self.settings.max_batch_wait
+        if not max_wait:
+            return
+        cur_time = time.time()
+        for group, count in list(self.counts.items()):
+            if not count:
+                continue
+            oldest = self.oldest(group)
+            if oldest is not None and cur_time - oldest >= max_wait:
+                self.flush(group, min(count, self.batch_size(group)))
+
+    # smallest batch size warm at this resolution that fits n frames
+    def padded_size(self, n, group):
+        for batch_size in self.warmup.batch_sizes(*group[:2]):  # grows as shapes are warmed
+            if batch_size >= n:
+                return batch_size
+        return n
+
+    def take(self, group, n):
+        sessions = self.pending[group]
+        order = self.order[group]
+        items = []
+        while len(items) < n and self.counts[group]:
+            session_id = order[0]
+            order.rotate(-1)
+            frames = sessions[session_id]
+            if frames:
+                items.append(frames.popleft())
+                self.counts[group] -= 1
+        if not self.counts[group]:
+            # groups come and go with settings changes, don't keep empty ones
+            del self.pending[group], self.order[group], self.counts[group]
+        return items
+
+    def flush(self, group, n):
+        items = self.take(group, n)
+        if not items:
+            return
+        try:
+            images = [img for img, frame in items]
+            frames = [frame for img, frame in items]
+            cur_time = time.time()
+            for frame in frames:
+                STAGE_SECONDS.observe(cur_time - frame.queued, stage="batch_wait")
+                if frame.trace:
+                    TRACER.add("batch_wait", frame.queued, cur_time, frame.trace)
+            # padding repeats the last frame, its results have no frame and are dropped
+            padding = self.padded_size(len(items), group) - len(items)
+            images += [images[-1]] * padding
+            frames += [None] * padding
+            batch = torch.stack(images)
+            batch = batch.to(torch.float32) / 255.0
+            self.emit((batch, frames))
+        except Exception as e:
+            # the frames are lost, but the websocket loop and the sessions keep running
+            print(f"Error flushing a batch of {len(items)} frames for {group}: {e}")
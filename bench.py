@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+from functools import partial
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import websockets
+from turbojpeg import TurboJPEG, TJPF_RGB
+
+import frame_protocol
+from gendj import ThreadedWebsocket, Processor, EncodeStream, BroadcastStream
+from metrics import STAGE_SECONDS, FRAMES
+from osc_settings_controller import OscSettingsController
+from readiness import Readiness, READY
+from replay import Replayer, ClientResults, percentiles
+from session_recorder import read_records, FRAME
+from settings import Settings
+from settings_api import SettingsAPI
+from warmup_spec import WarmupSpec
+
+
+class StubDiffusionProcessor:
+    # stands in for DiffusionProcessor on the CPU. sleeps for a fixed time
+    # per batch plus per frame and returns the inverted input, so decode,
+    # batching, encode and send run for real without a GPU.
+    def __init__(self, warmup=None, settings=None, latency=0.05, frame_latency=0.0, **kwargs):
+        self.settings = settings
+        self.warmup = warmup
+        self.latency = latency
+        self.frame_latency = frame_latency
+        self.startup_timings = {}
+        if warmup is not None:
+            for shape in warmup.shapes:
+                warmup.mark_warm(shape)
+
+    def warm_shape(self, shape, passes=2):
+        self.warmup.mark_warm(shape)
+
+    def run(
+        self,
+        images,
+        prompt,
+        num_inference_steps,
+        strength,
+        use_compel=True,
+        seed=None,
+        output_type="np",
+        traces=None,
+    ):
+        time.sleep(self.latency + self.frame_latency * len(images))
+        results = (1 - images).permute(0, 2, 3, 1)
+        if output_type == "uint8":
+            return (results * 255).round().to(torch.uint8).numpy()
+        return results.numpy()
+
+
+def synthetic_frames(count, width, height):
+    # a moving gradient, every frame differs so no cache can short cut it
+    jpeg = TurboJPEG()
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for i in range(count):
+        shift = i * 256 // count
+        img = np.stack(
+            [(x + shift) % 256, (y + 2 * shift) % 256, ((x + y) // 2 + shift) % 256],
+            axis=-1,
+        ).astype(np.uint8)
+        frames.append(jpeg.encode(img, quality=90, pixel_format=TJPF_RGB))
+    return frames
+
+
+def directory_frames(directory):
+    paths = sorted(
+        glob.glob(os.path.join(directory, "*.jpg")) + glob.glob(os.path.join(directory, "*.jpeg"))
+    )
+    if not paths:
+        raise SystemExit(f"No .jpg frames in {directory}")
+    frames = []
+    for path in paths:
+        with open(path, "rb") as f:
+            frames.append(f.read())
+    return frames
+
+
+def recording_frame(path):
+    # first frame of a recording, without its framed header
+    for record in read_records(path):
+        if record.kind == FRAME:
+            return bytes(frame_protocol.parse(record.payload)[1])
+    raise SystemExit(f"No frames in {path}")
+
+
+def frame_size(jpeg_bytes):
+    width, height, _, _ = TurboJPEG().decode_header(jpeg_bytes)
+    return width, height
+
+
+async def run_client(url, frames, fps, seconds, drain, offset, results):
+    async with websockets.connect(url, max_size=None) as websocket:
+
+        async def receive():
+            async for message in websocket:
+                header, payload = frame_protocol.parse(message)
+                if header is not None:
+                    results.record(header, frame_protocol.now_ms())
+
+        receiver = asyncio.create_task(receive())
+        interval = 1 / fps if fps else 0
+        start_time = time.time()
+        seq = 0
+        while time.time() - start_time < seconds:
+            header = frame_protocol.FrameHeader(seq, capture=frame_protocol.now_ms())
+            await websocket.send(header.pack() + frames[(offset + seq) % len(frames)])
+            results.sent += 1
+            seq += 1
+            await asyncio.sleep(max(0, start_time + seq * interval - time.time()))
+        await asyncio.sleep(drain)  # replies still in flight
+        receiver.cancel()
+
+
+async def run_clients(url, frames, args, results):
+    # the server may still be binding its port
+    for _ in range(50):
+        try:
+            async with websockets.connect(url):
+                break
+        except OSError:
+            await asyncio.sleep(0.1)
+    await asyncio.gather(
+        *[
+            run_client(url, frames, args.fps, args.seconds, args.drain, i * 7, result)
+            for i, result in enumerate(results)
+        ]
+    )
+
+
+def start_pipeline(settings, args):
+    readiness = Readiness()
+    warmup = WarmupSpec.from_settings(settings)
+    factory = partial(
+        StubDiffusionProcessor, latency=args.latency, frame_latency=args.frame_latency
+    )
+    receiver = ThreadedWebsocket(settings, warmup=warmup)
+    processor = Processor(
+        settings,
+        warmup=warmup,
+        readiness=readiness,
+        processor_factory=factory,
+        sessions=lambda: len(receiver.sessions),
+    ).feed(receiver)
+    encoder = EncodeStream(settings).feed(processor)
+    display = BroadcastStream(settings.output_port, settings, receiver).feed(encoder)
+    workers = [receiver, processor, encoder, display]
+    if args.recording:
+        # recordings carry SettingsAPI and OSC changes, replayed against these
+        SettingsAPI(settings, warmup=warmup).start()
+        OscSettingsController(settings, warmup=warmup).start()
+    for worker in reversed(workers):
+        worker.start()
+    while readiness.state != READY:
+        time.sleep(0.05)
+    return workers
+
+
+def report(results, workers, elapsed, cpu_time):
+    sent = sum(r.sent for r in results)
+    received = sum(r.received for r in results)
+    latency = [v for r in results for v in r.latency]
+    p = percentiles(latency)
+    result = {
+        "seconds": elapsed,
+        "sent_fps": sent / elapsed,
+        "ingest_fps": FRAMES.values.get(("in",), 0) / elapsed,
+        "output_fps": received / elapsed,
+        "lost": sent - received,
+        "latency_ms": {"p50": p[50], "p95": p[95], "p99": p[99]},
+        "latency_parts_ms": {
+            part: float(np.mean([v for r in results for v in getattr(r, part)] or [0]))
+            for part in ("ingest", "server", "returned")
+        },
+        "process_cpu": cpu_time / elapsed,  # cores in use on average
+        "stages": {},
+    }
+    for worker in workers[1:]:  # the websocket worker's work() is the event loop
+        stats = worker.stats()
+        result["stages"][worker.name] = {
+            "items_per_sec": stats["items_per_sec"],
+            "busy_ms": stats["busy"]["mean"] * 1000,
+            "busy_p99_ms": stats["busy"]["p99"] * 1000,
+            "cpu_ms": stats["cpu"]["mean"] * 1000,
+            "cpu_cores": stats["cpu"]["mean"] * stats["items_per_sec"],
+            "utilization": stats["utilization"],
+        }
+    # pool threads, wall time per frame
+    for stage in ("decode", "batch_wait", "encode", "send"):
+        count, total = STAGE_SECONDS.totals(stage=stage)
+        result["stages"][stage] = {"wall_ms": total / count * 1000 if count else 0}
+    return result
+
+
+def print_report(report):
+    print()
+    print(f"sent      {report['sent_fps']:8.1f} fps")
+    print(f"ingest    {report['ingest_fps']:8.1f} fps")
+    print(f"output    {report['output_fps']:8.1f} fps  ({report['lost']} frames lost)")
+    latency = report["latency_ms"]
+    print(
+        f"latency   p50 {latency['p50']:.1f}ms  p95 {latency['p95']:.1f}ms  p99 {latency['p99']:.1f}ms"
+    )
+    parts = report["latency_parts_ms"]
+    print(
+        f"  ingest {parts['ingest']:.1f}ms  server {parts['server']:.1f}ms  return {parts['returned']:.1f}ms"
+    )
+    print(f"cpu       {report['process_cpu']:.2f} cores")
+    for name, stage in report["stages"].items():
+        values = "  ".join(f"{k} {v:.2f}" for k, v in stage.items())
+        print(f"  {name:<16}{values}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the ingest, batching, encode and send path with a CPU stand-in for inference."
+    )
+    parser.add_argument("--frames", help="directory of .jpg frames, synthetic frames if not given")
+    parser.add_argument("--recording", help="replay a session recording instead of streaming frames")
+    parser.add_argument("--speed", type=float, default=1.0, help="recording playback speed, 0 as fast as possible")
+    parser.add_argument("--size", default="512x512", help="WxH of synthetic frames")
+    parser.add_argument("--clients", type=int, default=1)
+    parser.add_argument("--fps", type=float, default=30, help="per client, 0 sends as fast as possible")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--drain", type=float, default=1.0, help="seconds to wait for replies after sending")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub seconds per batch")
+    parser.add_argument("--frame_latency", type=float, default=0.0, help="stub seconds per frame")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    if args.recording:
+        frames = [recording_frame(args.recording)]
+    elif args.frames:
+        frames = directory_frames(args.frames)
+    else:
+        width, height = [int(e) for e in args.size.split("x")]
+        frames = synthetic_frames(64, width, height)
+    width, height = frame_size(frames[0])
+
+    settings = Settings(
+        device="cpu",
+        warmup=f"{args.batch_size}x{height}x{width}x3",
+        batch_size=args.batch_size,
+        websocket_port=args.port,
+        settings_port=args.port + 1,
+        osc_port=args.port + 2,
+        compile_cache_dir="",
+        embedding_cache_dir="",
+        result_cache_mb=0,
+        static_threshold=0,
+        adaptive_batch=False,
+    )
+    workers = start_pipeline(settings, args)
+
+    url = f"ws://localhost:{args.port}"
+    start_time = time.time()
+    start_cpu = time.process_time()
+    if args.recording:
+        replayer = Replayer(
+            args.recording,
+            websocket_port=args.port,
+            settings_port=args.port + 1,
+            osc_port=args.port + 2,
+            speed=args.speed,
+            framed=True,
+            drain=args.drain,
+        )
+        asyncio.run(replayer.play())
+        results = list(replayer.results.values())
+        seconds = replayer.elapsed
+    else:
+        results = [ClientResults() for _ in range(args.clients)]
+        asyncio.run(run_clients(url, frames, args, results))
+        seconds = args.seconds
+    cpu_time = time.process_time() - start_cpu
+    cpu_time *= seconds / (time.time() - start_time)  # cpu spent while sending
+    result = report(results, workers, seconds, cpu_time)
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+    for worker in workers:
+        worker.close()
+    os._exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -94,13 +94,13 @@ def cache_models():
     # This ensures the specific VAE files are in the VAE directory
     if vae is not None:
         try:
-            print(f"Attempting to save VAE to {SAVE_DIR_VAE} in .bin format...")
+            print(f"Attempting to save VAE to {SAVE_DIR_VAE} in .safetensors format...")
             vae.save_pretrained(
                 SAVE_DIR_VAE,
-                safe_serialization=False, # Force .bin
+                safe_serialization=True, # mmap'd by pipeline_loader at startup
                 # variant="fp16", # REMOVE variant argument
             )
-            print(f"VAE model saved to {SAVE_DIR_VAE} (attempted .bin format)")
+            print(f"VAE model saved to {SAVE_DIR_VAE} (.safetensors format)")
         except Exception as e:
             print(f"\n!!! ERROR saving VAE model to {SAVE_DIR_VAE}: {e}")
             traceback.print_exc()
@@ -0,0 +1,117 @@
+import fcntl
+import hashlib
+import importlib.metadata
+import json
+import os
+import time
+
+# libraries whose versions change what gets traced and compiled
+LIBRARIES = ("torch", "diffusers", "stable_fast", "triton", "xformers")
+
+
+def library_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def library_versions():
+    return {name: library_version(name) for name in LIBRARIES}
+
+
+def model_hash(model):
+    # cheap fingerprint of a local model directory from file names, sizes and
+    # mtimes. hub ids are used as is.
+    if not os.path.isdir(model):
+        return model
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(model):
+        dirs.sort()
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            path = os.path.relpath(os.path.join(root, name), model)
+            digest.update(f"{path}:{stat.st_size}:{int(stat.st_mtime)}".encode())
+    return digest.hexdigest()[:16]
+
+
+def config_dict(config):
+    return {
+        k: v
+        for k, v in sorted(vars(config).items())
+        if isinstance(v, (bool, int, float, str, type(None)))
+    }
+
+
+class CompileCache:
+    # persists compiler caches (Triton kernels) in a directory per key, where
+    # the key covers model, compile config, batch shapes and library versions.
+    # manifest.json records which keys completed a warmup. CUDA graphs and
+    # traced modules live in process memory and are rebuilt on every start,
+    # so a hit only means kernels load from disk and warmup can be shortened.
+    manifest_name = "manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, self.manifest_name)
+        self.manifest = self.load_manifest()
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable compile cache manifest: {e}")
+            return {}
+
+    def save_manifest(self):
+        tmp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
+
+    def key(self, model, config, shapes, versions=None):
+        payload = {
+            "model": model,
+            "config": config,
+            "shapes": shapes,
+            "versions": versions if versions is not None else library_versions(),
+        }
+        encoded = json.dumps(payload, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def lookup(self, key):
+        entry = self.manifest.get(key)
+        if entry is None or not os.path.isdir(self.path(key)):
+            return None
+        return entry
+
+    def activate(self, key):
+        # must run before anything compiles, compilers read these lazily
+        path = self.path(key)
+        os.makedirs(path, exist_ok=True)
+        os.environ["TRITON_CACHE_DIR"] = os.path.join(path, "triton")
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(path, "inductor")
+        return path
+
+    def compile(self, pipe, compiler, config, key):
+        # compiler is e.g. sfast's compile(pipe, config=config)
+        hit = self.lookup(key) is not None
+        print(f"Compile cache {'hit' if hit else 'miss'} for {key}")
+        self.activate(key)
+        return compiler(pipe, config=config), hit
+
+    def record(self, key, **info):
+        # workers sharing the directory record their own keys, merge with the
+        # manifest on disk under a lock instead of overwriting it
+        with open(f"{self.manifest_path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.manifest.update(self.load_manifest())
+            self.manifest[key] = {"created": time.time(), **info}
+            self.save_manifest()
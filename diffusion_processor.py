@@ -1,7 +1,8 @@
-import re
 import numpy as np
+import json
 import time
 import os
+import threading
 from fixed_seed import fix_seed
 import requests
 from sfast.compilers.stable_diffusion_pipeline_compiler import (
@@ -10,17 +11,63 @@ from sfast.compilers.stable_diffusion_pipeline_compiler import (
 )
 
 from diffusers.utils.logging import disable_progress_bar
-from diffusers import AutoPipelineForImage2Image, AutoencoderTiny
+from diffusers import AutoPipelineForImage2Image
 import torch
 import warnings
 
 from compel import Compel, ReturnedEmbeddingsType
 from fixed_size_dict import FixedSizeDict
+from embedding_cache import EmbeddingCache
+from prompt_blend import PromptBlend
+from image_utils import quantize_batch, PinnedBufferRing
+from warmup_spec import WarmupSpec, format_shape
+from pipeline_loader import load_pipeline
+from phase_timer import PhaseTimer
+from readiness import COMPILING, WARMING
+from metrics import PROMPT_CACHE
+from tracing import TRACER
+from compile_cache import CompileCache, model_hash, config_dict, library_version
+
+
+def mix_embeddings(embeds, weights, mode="linear"):
+    # reduce N stacked embeddings (N, ...) to one with a single weighted sum.
+    # slerp mixes directions on the unit sphere and magnitudes separately,
+    # which is exact slerp for two prompts with weights summing to one and
+    # a normalized spherical average for more.
+    dtype = embeds.dtype
+    embeds = embeds.float()
+    weights = torch.tensor(weights, device=embeds.device, dtype=torch.float32)
+    if mode == "linear":
+        return torch.tensordot(weights, embeds, dims=1).to(dtype)
+
+    norms = embeds.norm(dim=-1, keepdim=True)
+    directions = embeds / norms.clamp_min(1e-8)
+    if len(weights) == 2 and abs(float(weights.sum()) - 1) < 1e-6:
+        t = weights[1]
+        cos = (directions[0] * directions[1]).sum(dim=-1, keepdim=True)
+        theta = torch.acos(cos.clamp(-1, 1))
+        sin = torch.sin(theta)
+        # fall back to lerp where the directions (nearly) coincide
+        near = sin.abs() < 1e-4
+        sin = torch.where(near, torch.ones_like(sin), sin)
+        w0 = torch.where(near, 1 - t, torch.sin((1 - t) * theta) / sin)
+        w1 = torch.where(near, t, torch.sin(t * theta) / sin)
+        direction = w0 * directions[0] + w1 * directions[1]
+    else:
+        direction = torch.tensordot(weights, directions, dims=1)
+        direction = direction / direction.norm(dim=-1, keepdim=True).clamp_min(1e-8)
+    magnitude = torch.tensordot(weights, norms, dims=1)
+    return (direction * magnitude).to(dtype)
 
 
 class DiffusionProcessor:
     def __init__(
-        self, warmup=None, local_files_only=True, use_cached=False, settings=None
+        self,
+        warmup=None,
+        local_files_only=True,
+        use_cached=False,
+        settings=None,
+        readiness=None,
     ):
         self.settings = settings
         print("Settings2:", settings)
@@ -36,78 +83,126 @@ class DiffusionProcessor:
 
         disable_progress_bar()
 
-        if use_cached:
-            print(f"Loading cached base pipeline from: {base_model}")
-            self.pipe = AutoPipelineForImage2Image.from_pretrained(
-                base_model,
-                torch_dtype=torch.float16,
-                variant="fp16",
-                local_files_only=local_files_only,
-            )
-            print(f"Loading cached VAE from: {vae_model}")
-            # Revert to simpler directory load, which works now that buildspec creates the .safetensors file
-            vae = AutoencoderTiny.from_pretrained(
-                vae_model, # Path to the specific VAE files directory
-                torch_dtype=torch.float16,
-                local_files_only=local_files_only,
-            )
-            # Overwrite the VAE in the loaded pipeline
-            self.pipe.vae = vae
-        else:
-            print(f"Downloading base pipeline: {base_model}")
-            self.pipe = AutoPipelineForImage2Image.from_pretrained(
-                base_model,
-                torch_dtype=torch.float16,
-                variant="fp16",
-                local_files_only=local_files_only,
-            )
+        timer = PhaseTimer()
+        if readiness is not None:
+            readiness.add_source("startup_timings", timer.as_dict)
+
+        with timer.phase("load"):
+            if use_cached:
+                # components load concurrently from mmap'd safetensors, VAE included
+                print(f"Loading cached pipeline from: {base_model} and {vae_model}")
+                self.pipe = load_pipeline(
+                    base_model,
+                    vae_dir=vae_model,
+                    dtype=torch.float16,
+                    variant="fp16",
+                    workers=settings.load_workers if settings else 4,
+                )
+            else:
+                print(f"Downloading base pipeline: {base_model}")
+                self.pipe = AutoPipelineForImage2Image.from_pretrained(
+                    base_model,
+                    torch_dtype=torch.float16,
+                    variant="fp16",
+                    local_files_only=local_files_only,
+                )
 
-        fix_seed(self.pipe)
+            fix_seed(self.pipe)
 
         print("Model loaded")
 
-        config = CompilationConfig.Default()
-        config.enable_xformers = True
-        config.enable_triton = True
-        config.enable_cuda_graph = True
-        self.pipe = compile(self.pipe, config=config)
+        if not isinstance(warmup, WarmupSpec):
+            steps = settings.num_inference_steps if settings is not None else 2
+            warmup = WarmupSpec.parse(warmup, steps)
+        self.warmup = warmup
+        warmup_shapes = list(warmup.shapes)
+
+        if readiness is not None:
+            readiness.set_state(COMPILING)
+        with timer.phase("compile"):
+            config = CompilationConfig.Default()
+            config.enable_xformers = True
+            config.enable_triton = True
+            config.enable_cuda_graph = True
+            compile_cache = None
+            cache_hit = False
+            if settings is not None and settings.compile_cache_dir:
+                compile_cache = CompileCache(settings.compile_cache_dir)
+                cache_key = compile_cache.key(
+                    model_hash(base_model) + "|" + model_hash(vae_model),
+                    config_dict(config),
+                    warmup_shapes,
+                )
+                self.pipe, cache_hit = compile_cache.compile(
+                    self.pipe, compile, config, cache_key
+                )
+            else:
+                self.pipe = compile(self.pipe, config=config)
 
         print("Model compiled")
 
-        self.pipe.to(device="cuda", dtype=torch.float16)
-        self.pipe.set_progress_bar_config(disable=True)
+        with timer.phase("move to device"):
+            self.pipe.to(device="cuda", dtype=torch.float16)
+            self.pipe.set_progress_bar_config(disable=True)
 
         print("Model moved to GPU", flush=True)
 
-        self.compel = Compel(
-            tokenizer=[self.pipe.tokenizer, self.pipe.tokenizer_2],
-            text_encoder=[self.pipe.text_encoder, self.pipe.text_encoder_2],
-            returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
-            requires_pooled=[False, True],
-        )
-        self.prompt_cache = FixedSizeDict(32)
-        print("Prepared compel")
+        with timer.phase("compel setup"):
+            compel_args = dict(
+                returned_embeddings_type=ReturnedEmbeddingsType.PENULTIMATE_HIDDEN_STATES_NON_NORMALIZED,
+                requires_pooled=[False, True],
+            )
+            self.compel = Compel(
+                tokenizer=[self.pipe.tokenizer, self.pipe.tokenizer_2],
+                text_encoder=[self.pipe.text_encoder, self.pipe.text_encoder_2],
+                **compel_args,
+            )
+            self.prompt_cache = FixedSizeDict(32)
+            self.blend_cache = FixedSizeDict(64)
+            self.embed_lock = threading.Lock()
+            self.embedding_cache = None
+            if settings is not None and settings.embedding_cache_dir:
+                # the model's content and the arguments compel actually got
+                namespace = json.dumps(
+                    {
+                        "model": model_hash(base_model),
+                        "dtype": str(self.pipe.text_encoder.dtype),
+                        "compel": {k: str(v) for k, v in compel_args.items()},
+                        "compel_version": library_version("compel"),
+                    },
+                    sort_keys=True,
+                )
+                self.embedding_cache = EmbeddingCache(settings.embedding_cache_dir, namespace)
+            print("Prepared compel")
+
+            if settings is not None:
+                self.preload_prompts([settings.prompt] + self.read_setlist())
 
         self.generator = torch.manual_seed(0)
+        self.generators = FixedSizeDict(16)  # seed -> generator, reseeded per batch by fix_seed
+
+        # every result batch still queued or being encoded holds one host buffer.
+        # an unbounded queue (size 0) can hold any number, so nothing is reused
+        buffer_count = 4
+        if settings is not None:
+            queue_size = settings.batch_queue_size
+            buffer_count = queue_size + 2 if queue_size > 0 else 0
+        self.host_buffers = PinnedBufferRing(buffer_count)
 
-        if warmup:
+        if warmup_shapes:
+            if readiness is not None:
+                readiness.set_state(WARMING)
             print("Starting warmup")
-            warmup_shape = [int(e) for e in warmup.split("x")]
-            images = np.zeros(warmup_shape, dtype=np.float32)
-            for i in range(2):
-                print(f"Warmup {warmup} {i+1}/2")
-                start_time = time.time()
-                self.run(
-                    images=images,
-                    prompt=self.settings.prompt,
-                    use_compel=True,
-                    num_inference_steps=2,
-                    strength=0.7,
-                    seed=self.settings.seed,
+            # on a compile cache hit kernels load from disk, one pass validates
+            # each shape and captures its CUDA graph
+            passes = 1 if cache_hit else 2
+            for warmup_shape in warmup_shapes:
+                with timer.phase(f"warmup {format_shape(warmup_shape)}"):
+                    self.warm_shape(warmup_shape, passes)
+            if compile_cache is not None and not cache_hit:
+                compile_cache.record(
+                    cache_key, shapes=warmup_shapes, timings=timer.as_dict()
                 )
-                end_time = time.time()
-                duration = end_time - start_time
-                print(f"Warmup {i+1}/2 took {duration:.2f} seconds", flush=True)
             print("Warmup finished", flush=True)
             if "READY_WEBHOOK_URL" in os.environ:
                 webhook_url = os.environ["READY_WEBHOOK_URL"]
@@ -132,53 +227,148 @@ class DiffusionProcessor:
                 except Exception as e:
                     print(f"Error notifying webhook: {e}")
 
-    def embed_prompt(self, prompt):
-        if prompt not in self.prompt_cache:
+        print(timer.report(), flush=True)
+        self.startup_timings = timer.as_dict()
+
+    def warm_shape(self, shape, passes=2):
+        name = format_shape(shape)
+        images = np.zeros(
+            (shape.batch_size, shape.height, shape.width, shape.channels),
+            dtype=np.float32,
+        )
+        strength = self.settings.strength if self.settings is not None else 0.7
+        for i in range(passes):
+            print(f"Warmup {name} {i+1}/{passes}")
             start_time = time.time()
-            with torch.no_grad():
-                print("embedding prompt", prompt)
-                self.prompt_cache[prompt] = self.compel(prompt)
+            self.run(
+                images=images,
+                prompt=self.settings.prompt,
+                use_compel=True,
+                num_inference_steps=shape.steps,
+                strength=strength,
+                seed=self.settings.seed,
+            )
             end_time = time.time()
-            elapsed_time = end_time - start_time
-            print(f"Time taken to embed the prompt: {elapsed_time:.4f} seconds")
+            duration = end_time - start_time
+            print(f"Warmup {i+1}/{passes} took {duration:.2f} seconds", flush=True)
+        self.warmup.mark_warm(shape)
+
+    def read_setlist(self):
+        path = self.settings.prompt_setlist
+        if not path:
+            return []
+        try:
+            with open(path) as f:
+                return [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            print(f"Error reading prompt setlist {path}: {e}")
+            return []
+
+    def preload_prompts(self, prompts):
+        start_time = time.time()
+        for prompt in prompts:
+            self.meta_embed_prompt(prompt)
+        elapsed_time = time.time() - start_time
+        print(f"Preloaded {len(prompts)} prompts in {elapsed_time:.2f} seconds")
+
+    def embed_prompt(self, prompt):
+        if prompt not in self.prompt_cache:
+            embeds = None
+            if self.embedding_cache is not None:
+                embeds = self.embedding_cache.get(prompt, device="cuda")
+                PROMPT_CACHE.inc(cache="disk", result="miss" if embeds is None else "hit")
+            if embeds is None:
+                start_time = time.time()
+                with torch.no_grad():
+                    print("embedding prompt", prompt)
+                    embeds = self.compel(prompt)
+                end_time = time.time()
+                elapsed_time = end_time - start_time
+                print(f"Time taken to embed the prompt: {elapsed_time:.4f} seconds")
+                if self.embedding_cache is not None:
+                    self.embedding_cache.put(prompt, *embeds)
+            self.prompt_cache[prompt] = embeds
         return self.prompt_cache[prompt]
 
     def meta_embed_prompt(self, prompt):
-        pattern = r'\("(.*?)"\s*,\s*"(.*?)"\)\.blend\((.*?),(.*?)\)'
-        match = re.search(pattern, prompt)
-        if not match:
-            return self.embed_prompt(prompt)
-        str1, str2, t1, t2 = match.groups()
-        t1 = float(t1)
-        t2 = float(t2)
-        cond1, pool1 = self.embed_prompt(str1)
-        cond2, pool2 = self.embed_prompt(str2)
-        cond = cond1 * t1 + cond2 * t2
-        pool = pool1 * t1 + pool2 * t2
-        return cond, pool
+        # cache hits are lock free, so inference never waits on PromptEmbedder
+        blend = isinstance(prompt, PromptBlend)
+        cache, key = (self.blend_cache, prompt.key()) if blend else (self.prompt_cache, prompt)
+        try:
+            embeds = cache[key]
+            PROMPT_CACHE.inc(cache="memory", result="hit")
+            return embeds
+        except KeyError:
+            PROMPT_CACHE.inc(cache="memory", result="miss")
+        with self.embed_lock:
+            if not blend:
+                return self.embed_prompt(prompt)
+            if key not in self.blend_cache:
+                prompts, weights, mode = key
+                embeds = [self.embed_prompt(p) for p in prompts]
+                conds = torch.cat([cond for cond, pool in embeds])
+                pools = torch.cat([pool for cond, pool in embeds])
+                cond = mix_embeddings(conds, weights, mode).unsqueeze(0)
+                pool = mix_embeddings(pools, weights, mode).unsqueeze(0)
+                self.blend_cache[key] = cond, pool
+            return self.blend_cache[key]
 
     def run(
-        self, images, prompt, num_inference_steps, strength, use_compel=True, seed=None
+        self,
+        images,
+        prompt,
+        num_inference_steps,
+        strength,
+        use_compel=True,
+        seed=None,
+        output_type="np",
+        traces=None,
     ):
+        # prompt and seed are either shared by the batch or given per sample.
+        # traces are the trace ids of the sampled frames in the batch
+        run_start = time.time()
         strength = min(max(1 / num_inference_steps, strength), 1)
-        if seed is not None:
-            self.generator = torch.manual_seed(seed)
+        if isinstance(seed, list):
+            self.generator = [torch.Generator().manual_seed(s) for s in seed]
+        elif seed is not None:
+            if seed not in self.generators:
+                self.generators[seed] = torch.Generator().manual_seed(seed)
+            self.generator = self.generators[seed]
         kwargs = {}
-        if use_compel:
-            conditioning, pooled = self.meta_embed_prompt(prompt)
-            batch_size = len(images)
-            conditioning_batch = conditioning.expand(batch_size, -1, -1)
-            pooled_batch = pooled.expand(batch_size, -1)
-            kwargs["prompt_embeds"] = conditioning_batch
-            kwargs["pooled_prompt_embeds"] = pooled_batch
-        else:
-            kwargs["prompt"] = [prompt] * len(images)
-        return self.pipe(
-            image=images,
-            generator=self.generator,
-            num_inference_steps=num_inference_steps,
-            guidance_scale=0,
-            strength=strength,
-            output_type="np",
-            **kwargs,
-        ).images
+        with TRACER.span("embed", traces):
+            if use_compel and isinstance(prompt, list):
+                embeds = [self.meta_embed_prompt(p) for p in prompt]
+                kwargs["prompt_embeds"] = torch.cat([cond for cond, pool in embeds])
+                kwargs["pooled_prompt_embeds"] = torch.cat([pool for cond, pool in embeds])
+            elif use_compel:
+                conditioning, pooled = self.meta_embed_prompt(prompt)
+                batch_size = len(images)
+                conditioning_batch = conditioning.expand(batch_size, -1, -1)
+                pooled_batch = pooled.expand(batch_size, -1)
+                kwargs["prompt_embeds"] = conditioning_batch
+                kwargs["pooled_prompt_embeds"] = pooled_batch
+            elif isinstance(prompt, list):
+                kwargs["prompt"] = prompt
+            else:
+                kwargs["prompt"] = [prompt] * len(images)
+        # uint8 quantizes on the device and does one batched copy into a pinned buffer
+        with TRACER.span("pipe", traces, steps=num_inference_steps):
+            results = self.pipe(
+                image=images,
+                generator=self.generator,
+                num_inference_steps=num_inference_steps,
+                guidance_scale=0,
+                strength=strength,
+                output_type="pt" if output_type == "uint8" else output_type,
+                **kwargs,
+            ).images
+        if output_type == "uint8":
+            with TRACER.span("copy", traces):
+                results = quantize_batch(results)
+                if results.is_cuda:
+                    results = self.host_buffers.copy(results)
+                else:
+                    results = results.numpy()
+        if traces:
+            TRACER.add("DiffusionProcessor.run", run_start, time.time(), traces)
+        return results
@@ -0,0 +1,47 @@
+import hashlib
+import json
+import os
+from safetensors import safe_open
+from safetensors.torch import save_file
+
+
+class EmbeddingCache:
+    # content addressed on-disk store for compel (cond, pooled) embeddings.
+    # one safetensors file per prompt, named by a hash of the prompt and the
+    # namespace (model and compel config), read through mmap on first use.
+    def __init__(self, directory, namespace):
+        self.directory = directory
+        self.namespace = namespace
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, prompt):
+        key = json.dumps([self.namespace, prompt]).encode("utf-8")
+        digest = hashlib.sha256(key).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".safetensors")
+
+    def get(self, prompt, device="cpu"):
+        path = self.path(prompt)
+        if not os.path.exists(path):
+            return None
+        try:
+            with safe_open(path, framework="pt", device=device) as f:
+                embeds = f.get_tensor("cond"), f.get_tensor("pooled")
+        except Exception as e:
+            print(f"Error reading cached embedding {path}: {e}")
+            return None
+        return embeds
+
+    def put(self, prompt, cond, pooled):
+        path = self.path(prompt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tensors = {
+            "cond": cond.detach().contiguous().cpu(),
+            "pooled": pooled.detach().contiguous().cpu(),
+        }
+        # write then rename so concurrent workers never read a partial file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            save_file(tensors, tmp_path, metadata={"prompt": prompt})
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"Error caching embedding {path}: {e}")
@@ -5,6 +5,26 @@ from diffusers.pipelines.stable_diffusion_xl.pipeline_stable_diffusion_xl_img2im
     retrieve_latents,
 )
 from diffusers.utils.torch_utils import randn_tensor
+from fixed_size_dict import FixedSizeDict
+
+
+def make_noise(self, shape, generator, device, dtype):
+    # the noise only depends on the seeds and the shape, so it is drawn once
+    # and reused. the generator states after the draw are cached with it and
+    # restored on a hit, so later draws (scheduler steps) stay bit identical.
+    if generator is None:
+        return randn_tensor(shape, generator=generator, device=device, dtype=dtype)
+    generators = generator if isinstance(generator, list) else [generator]
+    seeds = tuple(g.initial_seed() for g in generators)
+    key = (seeds, tuple(shape), dtype, str(device))
+    if key in self.noise_cache:
+        noise, states = self.noise_cache[key]
+        for g, state in zip(generators, states):
+            g.set_state(state)
+        return noise
+    noise = randn_tensor(shape, generator=generator, device=device, dtype=dtype)
+    self.noise_cache[key] = noise, [g.get_state() for g in generators]
+    return noise
 
 
 def prepare_latents(
@@ -33,6 +53,11 @@ def prepare_latents(
 
     batch_size = batch_size * num_images_per_prompt
 
+    # every call starts from the seed, the same as seeding before each batch
+    if generator is not None:
+        for g in generator if isinstance(generator, list) else [generator]:
+            g.manual_seed(g.initial_seed())
+
     if image.shape[1] == 4:
         init_latents = image
 
@@ -48,16 +73,8 @@ def prepare_latents(
                 f" size of {batch_size}. Make sure the batch size matches the length of the generators."
             )
 
-        elif isinstance(generator, list):
-            init_latents = [
-                retrieve_latents(
-                    self.vae.encode(image[i : i + 1]), generator=generator[i]
-                )
-                for i in range(batch_size)
-            ]
-            init_latents = torch.cat(init_latents, dim=0)
-        else:
-            init_latents = retrieve_latents(self.vae.encode(image), generator=generator)
+        # a list of generators still encodes the whole batch in one pass
+        init_latents = retrieve_latents(self.vae.encode(image), generator=generator)
 
         if self.vae.config.force_upcast:
             self.vae.to(dtype)
@@ -77,9 +94,12 @@ def prepare_latents(
         init_latents = torch.cat([init_latents], dim=0)
 
     if add_noise:
-        if fixed_noise:  # use same noise for all images
+        if isinstance(generator, list):  # per sample seeds, one noise row each
+            shape = init_latents.shape
+            noise = self.make_noise(shape, generator, device, dtype)
+        elif fixed_noise:  # use same noise for all images
             shape = init_latents.shape[1:]
-            noise = randn_tensor(shape, generator=generator, device=device, dtype=dtype)
+            noise = self.make_noise(shape, generator, device, dtype)
             noise = noise.expand(batch_size, *noise.shape)
         else:  # use different noise for each image
             shape = init_latents.shape
@@ -92,5 +112,7 @@ def prepare_latents(
     return latents
 
 
-def fix_seed(pipe):
+def fix_seed(pipe, noise_cache_size=8):
+    pipe.noise_cache = FixedSizeDict(noise_cache_size)
+    pipe.make_noise = types.MethodType(make_noise, pipe)
     pipe.prepare_latents = types.MethodType(prepare_latents, pipe)
@@ -0,0 +1,52 @@
+import struct
+import time
+
+# optional binary header in front of the JPEG bytes, in both directions.
+# clients send it with seq and capture set and the other fields zero, the
+# server echoes it back with its own receive, infer and send times filled
+# in. timestamps are float milliseconds since the epoch; capture is in the
+# client's clock, the rest in the server's. messages without the magic are
+# plain JPEG (which always starts with ff d8) and are answered the same way.
+MAGIC = b"GDJ1"
+HEADER = struct.Struct("<4sIdddd")  # magic, seq, capture, receive, infer, send
+
+
+class FrameHeader:
+    def __init__(self, seq, capture=0.0, received=0.0, inferred=0.0, sent=0.0):
+        self.seq = seq
+        self.capture = capture
+        self.received = received
+        self.inferred = inferred
+        self.sent = sent
+
+    def pack(self):
+        return HEADER.pack(
+            MAGIC, self.seq, self.capture, self.received, self.inferred, self.sent
+        )
+
+    def __repr__(self):
+        return f"FrameHeader(seq={self.seq})"
+
+
+def now_ms():
+    return time.time() * 1000
+
+
+def parse(message):
+    # returns (header or None, jpeg payload)
+    if len(message) >= HEADER.size and message[:4] == MAGIC:
+        _, seq, capture, received, inferred, sent = HEADER.unpack_from(message)
+        header = FrameHeader(seq, capture, received, inferred, sent)
+        return header, memoryview(message)[HEADER.size :]
+    return None, message
+
+
+def reply(frame, jpeg):
+    # fills the server timestamps of a FrameInfo into its header, if any
+    header = frame.header
+    if header is None:
+        return jpeg
+    header.received = frame.received * 1000
+    header.inferred = (frame.inferred or frame.received) * 1000
+    header.sent = now_ms()
+    return header.pack() + jpeg
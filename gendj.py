@@ -6,7 +6,17 @@ import torch
 import torch.nn.functional as F
 from turbojpeg import TurboJPEG, TJPF_RGB
 from threaded_worker import ThreadedWorker
-from diffusion_processor import DiffusionProcessor
+from session import Session, FrameInfo
+from batch_scheduler import BatchScheduler
+from batch_controller import AdaptiveBatchController
+from warmup_spec import WarmupSpec, format_shape
+from readiness import Readiness, READY
+from metrics import REGISTRY, STAGE_SECONDS, FRAME_LATENCY, FRAMES
+from tracing import TRACER
+from session_recorder import Recorder
+import frame_protocol
+from result_cache import ResultCache
+from prompt_embedder import PromptEmbedder
 from settings import Settings
 from settings_api import SettingsAPI
 from osc_settings_controller import OscSettingsController
@@ -26,65 +36,231 @@ import signal
 import sys
 import argparse
 import os
+import json
 
 from websockets.server import serve
 
 
 class ThreadedWebsocket(ThreadedWorker):
-    def __init__(self, settings):
-        super().__init__(has_input=False, has_output=True)
+    def __init__(
+        self,
+        settings,
+        batch_controller=None,
+        result_cache=None,
+        warmup=None,
+        recorder=None,
+        prompt_embedder=None,
+    ):
+        super().__init__(
+            has_input=False,
+            has_output=True,
+            queue_size=settings.batch_queue_size,
+            queue_policy=settings.queue_policy,
+            max_age=settings.max_frame_age,
+        )
         self.ws_port = settings.websocket_port
-        self.jpeg = TurboJPEG()
-        self.websocket = None
-        self.batch = []
-        self.settings_batch = []
-        self.batch_size = settings.batch_size
+        self.decode_workers = settings.decode_workers
+        self.decode_pool = ThreadPoolExecutor(
+            max_workers=self.decode_workers, thread_name_prefix="decode"
+        )
+        self.decoders = threading.local()
+        self.sessions = {}
+        self.warmup = warmup if warmup is not None else WarmupSpec.from_settings(settings)
+        self.resolutions = {}  # (height, width, warmup version) -> (size, crop)
+        self.warmup.serving = self.served_resolutions  # runtime changes snap to these
+        self.scheduler = BatchScheduler(settings, self.output_queue.put, self.warmup)
+        self.batch_controller = batch_controller
+        self.result_cache = result_cache
+        self.recorder = recorder
+        self.prompt_embedder = prompt_embedder  # embeds per-session prompt overrides
         self.loop = None
         self.settings = settings
         self.server = None
         self.stop_event = threading.Event()
         self.cleanup_called = False  # Add this flag
 
+    def decode_frame(self, frame_data, scene, trace=None):
+        # runs on the decode pool, each thread keeps its own TurboJPEG handle
+        start_time = time.time()
+        jpeg = getattr(self.decoders, "jpeg", None)
+        if jpeg is None:
+            jpeg = self.decoders.jpeg = TurboJPEG()
+        frame_data_np = np.frombuffer(frame_data, dtype=np.uint8)
+        frame = jpeg.decode(frame_data_np, pixel_format=TJPF_RGB)
+        thumbnail = scene.thumbnail(frame) if scene is not None else None
+        img = torch.from_numpy(frame).permute(2, 0, 1)
+        img = img.to(self.settings.device)  # on the GPU from here, unless benchmarking
+        size, crop = self.target_size(*frame.shape[:2])
+        if crop != frame.shape[:2]:
+            top = (frame.shape[0] - crop[0]) // 2
+            left = (frame.shape[1] - crop[1]) // 2
+            img = img[:, top : top + crop[0], left : left + crop[1]]
+        if size != crop:
+            img = F.interpolate(img[None].float(), size=size, mode="bilinear", antialias=True)
+            img = img[0].round().to(torch.uint8)
+        end_time = time.time()
+        STAGE_SECONDS.observe(end_time - start_time, stage="decode")
+        if trace:
+            TRACER.add("decode", start_time, end_time, trace)
+        return img, thumbnail
+
+    # a resolution that was never warmed is resized to the nearest warm one
+    # instead of recompiling mid stream, preferring one with the same aspect
+    # ratio. otherwise the frame is center cropped to the warm shape's aspect
+    # ratio first, so it is never stretched. the client's resolution is queued
+    # at the configured batch size and steps, and used once it is warm.
+    # returns the size to infer at and the size of the centered crop
+    def target_size(self, height, width):
+        key = (height, width, self.warmup.version)
+        sizes = self.resolutions.get(key)
+        if sizes is None:
+            shape = self.warmup.request(
+                self.settings.batch_size,
+                height,
+                width,
+                self.settings.num_inference_steps,
+            )
+            size = (height, width) if shape is None else (shape.height, shape.width)
+            crop = (height, width)
+            if height * size[1] > width * size[0]:
+                crop = (round(width * size[0] / size[1]), width)
+            elif height * size[1] < width * size[0]:
+                crop = (height, round(height * size[1] / size[0]))
+            sizes = self.resolutions[key] = (size, crop)
+        return sizes
+
+    def served_resolutions(self):
+        # called from the settings api thread, copy before iterating
+        sessions = list(self.sessions.values())
+        return {session.size for session in sessions if session.size is not None}
+
+    async def assemble(self, session, pending):
+        # decodes finish out of order, await them in arrival order
+        while True:
+            decoded, frame = await pending.get()
+            try:
+                img, thumbnail = await decoded
+            except Exception as e:
+                print(f"Error decoding frame: {e}")
+                continue
+            if thumbnail is not None and session.last_output is not None and session.caught_up():
+                settings_key = Session.settings_key(frame.settings)
+                if session.scene.is_static(thumbnail, settings_key):
+                    # nothing changed, answer with the previous output
+                    self.send_reply(session.id, frame, session.last_output, reused="static")
+                    continue
+            session.last_queued = frame.index
+            session.size = tuple(img.shape[-2:])
+            self.scheduler.add(session.id, img, frame)
+            self.scheduler.poll()
+
     async def handler(self, websocket, path):
-        self.websocket = websocket
-        print("WebSocket connection opened")
+        session = Session(websocket, self.settings, self.prompt_embedder)
+        self.sessions[session.id] = session
+        print(f"WebSocket connection opened, session {session.id}")
+        if self.recorder is not None:
+            self.recorder.open_session(session.id)
         first_frame = True
+        pending = asyncio.Queue(maxsize=self.decode_workers * 2)
+        assembler = asyncio.create_task(self.assemble(session, pending))
+        sender = asyncio.create_task(self.send_replies(session))
         try:
             while True:
                 frame_data = await websocket.recv()
+                if self.recorder is not None:
+                    self.recorder.message(session.id, frame_data)
+                if isinstance(frame_data, str):
+                    # text messages carry per-session settings as json
+                    try:
+                        session.update(json.loads(frame_data))
+                    except (ValueError, TypeError, AttributeError) as e:
+                        print(f"Session {session.id}: ignoring settings message: {e}")
+                    continue
                 if first_frame:
                     print(f"Received frame of size {len(frame_data)} bytes")
                     first_frame = False
-                frame_data_np = np.frombuffer(frame_data, dtype=np.uint8)
-                frame = self.jpeg.decode(frame_data_np, pixel_format=TJPF_RGB)
-                img = torch.from_numpy(frame).permute(2, 0, 1)
-                self.batch.append(img.to("cuda"))  # on GPU from here
-                self.settings_batch.append(self.settings.copy())
-
-                n = self.batch_size
-                if len(self.batch) >= n:
-                    batch = torch.stack(self.batch[:n])
-                    batch = batch.to(torch.float32) / 255.0
-                    settings_batch = self.settings_batch[:n]
-                    self.batch = self.batch[n:]  # drop the first n elements
-                    self.settings_batch = self.settings_batch[n:]
-                    self.output_queue.put((batch, settings_batch))
+                session.frames_in += 1
+                FRAMES.inc(direction="in")
+                if self.batch_controller is not None:
+                    self.batch_controller.observe_frame()
+                header, frame_data = frame_protocol.parse(frame_data)
+                if header is not None:
+                    session.check_sequence(header.seq)
+                frame = FrameInfo(session.id, session.current_settings(), header)
+                frame.index = session.frames_in
+                frame.trace = TRACER.sample()
+
+                if self.result_cache is not None:
+                    frame.cache_key = ResultCache.key(frame_data, frame.settings)
+                    cached = None
+                    if session.caught_up(dispatched=True):
+                        cached = self.result_cache.get(frame.cache_key)
+                    if cached is not None:
+                        # same input and parameters as an earlier frame
+                        session.last_output = cached
+                        self.send_reply(session.id, frame, cached, reused="cache")
+                        continue
+
+                decoded = self.loop.run_in_executor(
+                    self.decode_pool, self.decode_frame, frame_data, session.scene, frame.trace
+                )
+                session.last_dispatched = frame.index
+                await pending.put((decoded, frame))
+                if frame.trace:
+                    TRACER.add("receive", frame.received, time.time(), frame.trace)
 
         except websockets.exceptions.ConnectionClosed:
-            print("WebSocket connection closed")
+            print(f"WebSocket connection closed, session {session.id}")
         except Exception as e:
             print(f"Error in WebSocket handler: {e}")
         finally:
-            print("WebSocket handler finished")
-
-    async def send_data(self, data):
-        if self.websocket is not None and self.websocket.open:
+            assembler.cancel()
+            sender.cancel()
+            if self.recorder is not None:
+                self.recorder.close_session(session.id)
+            del self.sessions[session.id]
+            self.scheduler.remove(session.id)
+            print("WebSocket handler finished", session)
+
+    # queue a reply on the session's outbox, runs on the event loop. reused
+    # says why an earlier output answers this frame, None for new outputs
+    def send_reply(self, session_id, frame, jpeg, reused=None):
+        session = self.sessions.get(session_id)
+        if session is None:
+            print(f"No active WebSocket connection for session {session_id}")
+            return
+        if reused is None:
+            session.last_output = jpeg
+        session.last_replied = max(session.last_replied, frame.index)
+        if session.outbox_size and session.outbox.qsize() >= session.outbox_size:
+            session.outbox.get_nowait()  # drop the oldest, the client is behind
+            session.replies_dropped += 1
+        session.outbox.put_nowait((frame, jpeg, reused))
+
+    # one sender per session, a client that reads slowly only delays itself
+    async def send_replies(self, session):
+        while True:
+            frame, jpeg, reused = await session.outbox.get()
+            start_time = time.time()
             try:
-                await self.websocket.send(data)
+                await session.websocket.send(frame_protocol.reply(frame, jpeg))
+            except websockets.exceptions.ConnectionClosed:
+                return
             except Exception as e:
                 print(f"Error sending data: {e}")
-        else:
-            print("No active WebSocket connection")
+                continue
+            cur_time = time.time()
+            session.frames_out += 1
+            FRAMES.inc(direction="out")
+            if reused is None:
+                STAGE_SECONDS.observe(cur_time - start_time, stage="send")
+                FRAME_LATENCY.observe(cur_time - frame.received)
+            if frame.trace:
+                if reused is None:
+                    TRACER.add("send", start_time, cur_time, frame.trace)
+                    TRACER.add_frame(frame.trace, frame.received, cur_time, session=session.id)
+                else:
+                    TRACER.add_frame(frame.trace, frame.received, cur_time, reused=reused)
 
     def setup(self):
         self.loop = asyncio.new_event_loop()
@@ -103,8 +279,11 @@ class ThreadedWebsocket(ThreadedWorker):
             self.loop.call_soon_threadsafe(self.cleanup)
 
     async def run_server(self):
+        # tick often enough to honour the partial batch deadline
+        tick = min(max(self.settings.max_batch_wait / 4 or 0.1, 0.001), 0.1)
         while not self.stop_event.is_set():
-            await asyncio.sleep(0.1)
+            self.scheduler.poll()
+            await asyncio.sleep(tick)
 
     async def async_cleanup(self):
         if self.server:
@@ -128,6 +307,7 @@ class ThreadedWebsocket(ThreadedWorker):
         self.cleanup_called = True
 
         print("ThreadedWebsocket cleanup")
+        self.decode_pool.shutdown(wait=False, cancel_futures=True)
         if self.loop and not self.loop.is_closed():
             try:
                 self.stop_loop()
@@ -158,46 +338,225 @@ class ThreadedWebsocket(ThreadedWorker):
 
 
 class Processor(ThreadedWorker):
-    def __init__(self, settings, use_cached=False):
-        super().__init__(has_input=True, has_output=True, debug=True)
+    def __init__(
+        self,
+        settings,
+        use_cached=False,
+        batch_controller=None,
+        prompt_embedder=None,
+        warmup=None,
+        readiness=None,
+        processor_factory=None,
+        sessions=None,
+    ):
+        super().__init__(
+            has_input=True,
+            has_output=True,
+            debug=True,
+            queue_size=settings.batch_queue_size,
+            queue_policy=settings.queue_policy,
+            max_age=settings.max_frame_age,
+        )
         self.batch_size = settings.batch_size
         self.settings = settings
         print("Settings1:", settings)
 
-        self.jpeg = TurboJPEG()
         self.use_cached = use_cached
+        self.batch_controller = batch_controller
+        self.prompt_embedder = prompt_embedder
+        self.warmup = warmup if warmup is not None else WarmupSpec.from_settings(settings)
+        self.readiness = readiness
+        # builds the DiffusionProcessor, bench.py passes a CPU stand-in
+        self.processor_factory = processor_factory
+        self.sessions = sessions  # returns how many clients are connected
 
     def setup(self):
-        warmup = None
         if self.settings.warmup:
-            warmup = self.settings.warmup  # f"{settings.batch_size}x{settings.warmup}"
-            print(f"warmup from settings is: {warmup}")
-        self.diffusion_processor = DiffusionProcessor(
-            warmup=warmup, use_cached=self.use_cached, settings=self.settings
-        )
+            print(f"warmup from settings is: {self.settings.warmup}")
+        factory = self.processor_factory
+        if factory is None:
+            from diffusion_processor import DiffusionProcessor  # needs the CUDA stack
+
+            factory = DiffusionProcessor
+        try:
+            self.diffusion_processor = factory(
+                warmup=self.warmup,
+                use_cached=self.use_cached,
+                settings=self.settings,
+                readiness=self.readiness,
+            )
+        except Exception as e:
+            # without this the status would report loading or compiling forever
+            if self.readiness is not None:
+                self.readiness.fail("setup", e)
+            raise
+        if self.prompt_embedder is not None:
+            self.prompt_embedder.attach(self.diffusion_processor)
         self.clear_input()  # drop old frames
         self.runs = 0
+        if self.readiness is not None:
+            self.readiness.set_state(READY)
 
     def work(self, args):
-        images, settings_batch = args
+        # a batch the pipeline rejects is dropped, inference goes on for the rest
+        try:
+            return self.run_batch(*args)
+        except Exception as e:
+            print(f"Error processing a batch of {len(args[1])} frames: {e}")
+            return None
+
+    def run_batch(self, images, frames):
+        work_start = time.time()
+
+        # batches mix sessions, condition per sample only when they differ.
+        # padding rows have no frame and reuse the last real frame's settings
+        real_frames = [frame for frame in frames if frame is not None]
+        frame_settings = [(frame or real_frames[-1]).settings for frame in frames]
+        prompts = [settings.prompt for settings in frame_settings]
+        seeds = [settings.seed for settings in frame_settings]
+        prompt = prompts[0] if len(set(prompts)) == 1 else prompts
+        seed = seeds[0] if len(set(seeds)) == 1 else seeds
+        # steps and strength apply to the whole batch, BatchScheduler only
+        # batches frames that agree on them
+        first_settings = real_frames[0].settings
+        traces = [frame.trace for frame in real_frames if frame.trace]
+        batch_size, _, height, width = images.shape
+        num_inference_steps = self.warmup.snap_steps(
+            first_settings.num_inference_steps, batch_size, height, width
+        )
 
+        start_time = time.time()
         results = self.diffusion_processor.run(
             images=images,
-            prompt=self.settings.prompt,
+            prompt=prompt,
             use_compel=True,
-            num_inference_steps=2,
-            strength=0.7,
-            seed=self.settings.seed,
+            num_inference_steps=num_inference_steps,
+            strength=first_settings.strength,
+            seed=seed,
+            output_type=self.settings.output_type,
+            traces=traces,
         )
 
-        for frame_settings, image, result in zip(settings_batch, images, results):
-            result_uint8 = (result * 255).astype(np.uint8)
-            result_bytes = self.jpeg.encode(result_uint8, pixel_format=TJPF_RGB)
-            self.output_queue.put(result_bytes)
+        inferred = time.time()
+        STAGE_SECONDS.observe(inferred - start_time, stage="infer")
+        for frame in real_frames:
+            frame.inferred = inferred
+        if self.readiness is not None:
+            self.readiness.batch_done()
+
+        if self.batch_controller is not None:
+            cur_time = time.time()
+            self.batch_controller.observe_batch(len(images), cur_time - start_time)
+            for frame in real_frames:
+                self.batch_controller.observe_latency(cur_time - frame.received)
+            self.batch_controller.update()
+
         self.runs += 1
         if self.runs < 3:
             print("warming up, dropping old frames")
             self.clear_input()
+        if traces:
+            TRACER.add("Processor.work", work_start, time.time(), traces, batch_size=len(images))
+        return results, frames
+
+    # problem description for Readiness, None while healthy
+    def health(self):
+        if not self.parallel.is_alive():
+            return "not running"
+        waiting = self.input_queue.qsize()
+        idle_for = time.time() - (self.readiness.last_batch or self.readiness.since)
+        if waiting and idle_for > self.readiness.stall_timeout:
+            return f"stalled for {idle_for:.1f}s with {waiting} batches waiting"
+        return None
+
+    def idle(self):
+        # shapes requested at runtime are compiled between sessions. compiling
+        # takes seconds on this thread, frames arriving meanwhile would wait
+        shape = self.warmup.next_pending()
+        if shape is None or not hasattr(self, "diffusion_processor"):
+            return
+        if self.sessions is not None and self.sessions():
+            return
+        try:
+            self.diffusion_processor.warm_shape(shape)
+        except Exception as e:
+            print(f"Warmup of {format_shape(shape)} failed: {e}")
+            self.warmup.discard(shape)
+
+
+class EncodeStream(ThreadedWorker):
+    def __init__(self, settings, result_cache=None):
+        super().__init__(
+            has_input=True,
+            has_output=True,
+            debug=True,
+            queue_size=settings.frame_queue_size,
+            queue_policy=settings.queue_policy,
+            max_age=settings.max_frame_age,
+        )
+        self.settings = settings
+        self.result_cache = result_cache
+        self.encode_workers = settings.encode_workers
+        self.encode_pool = ThreadPoolExecutor(
+            max_workers=self.encode_workers, thread_name_prefix="encode"
+        )
+        self.encoders = threading.local()
+        # thread-seconds spent encoding, which used to block the inference thread
+        self.encode_time = 0
+        self.batches = 0
+        self.frames = 0
+        self.last_report = time.time()
+
+    def encode_frame(self, result, trace=None):
+        jpeg = getattr(self.encoders, "jpeg", None)
+        if jpeg is None:
+            jpeg = self.encoders.jpeg = TurboJPEG()
+        start_time = time.time()
+        if result.dtype != np.uint8:
+            result = (result * 255).astype(np.uint8)
+        result_bytes = jpeg.encode(result, pixel_format=TJPF_RGB)
+        end_time = time.time()
+        if trace:
+            TRACER.add("encode", start_time, end_time, trace)
+        return result_bytes, end_time - start_time
+
+    def recovered_idle(self):
+        # mean GPU idle time per batch that encoding no longer adds to Processor
+        if self.batches == 0:
+            return 0
+        return self.encode_time / self.batches
+
+    def work(self, args):
+        results, frames = args
+        results = [r for frame, r in zip(frames, results) if frame is not None]
+        frames = [frame for frame in frames if frame is not None]
+        encoded = [
+            self.encode_pool.submit(self.encode_frame, r, frame.trace)
+            for frame, r in zip(frames, results)
+        ]
+
+        # reorder buffer: frames are emitted in submission order
+        for frame, future in zip(frames, encoded):
+            result_bytes, duration = future.result()
+            self.encode_time += duration
+            STAGE_SECONDS.observe(duration, stage="encode")
+            if self.result_cache is not None and frame.cache_key is not None:
+                self.result_cache.put(frame.cache_key, result_bytes)
+            self.output_queue.put((frame, result_bytes))
+        self.batches += 1
+        self.frames += len(encoded)
+
+        cur_time = time.time()
+        if self.debug and cur_time - self.last_report > self.print_interval:
+            print(
+                self.name,
+                f"recovered {self.recovered_idle()*1000:.2f}ms GPU idle per batch",
+                flush=True,
+            )
+            self.last_report = cur_time
+
+    def cleanup(self):
+        self.encode_pool.shutdown(wait=False, cancel_futures=True)
 
 
 class BroadcastStream(ThreadedWorker):
@@ -213,25 +572,14 @@ class BroadcastStream(ThreadedWorker):
     def setup(self):
         self.jpeg = TurboJPEG()
 
-    def broadcast_msg(self, jpg):
+    def work(self, args):
+        frame, jpg = args
         try:
             if self.threaded_websocket is not None:
-                future = asyncio.run_coroutine_threadsafe(
-                    self.threaded_websocket.send_data(jpg), self.threaded_websocket.loop
+                # hand over without waiting, each session sends from its own outbox
+                self.threaded_websocket.loop.call_soon_threadsafe(
+                    self.threaded_websocket.send_reply, frame.session_id, frame, jpg
                 )
-                future.result()  # Wait for the coroutine to complete
-            else:
-                print("No active WebSocket connection")
-        except Exception as e:
-            print(f"Error in broadcast_msg: {e}")
-
-    def work(self, frame):
-        try:
-            while self.input_queue.qsize() > self.settings.batch_size:
-                frame = self.input_queue.get()
-
-            if self.threaded_websocket is not None:
-                self.broadcast_msg(frame)
             else:
                 print("No active WebSocket connection")
         except Exception as e:
@@ -257,17 +605,171 @@ def main():
 
     settings = Settings()
     print(f"Using websocket_port from Settings: {settings.websocket_port}")
-    settings_api = SettingsAPI(settings)
-    settings_controller = OscSettingsController(settings)
+    prompt_embedder = PromptEmbedder(settings)
+    TRACER.configure(settings.trace_sample_rate, settings.trace_buffer)
+    warmup = WarmupSpec.from_settings(settings)
+    readiness = Readiness(settings.status_file, stall_timeout=settings.stall_timeout)
+    recorder = Recorder(settings.record_file) if settings.record_file else None
+    settings_api = SettingsAPI(
+        settings,
+        prompt_embedder=prompt_embedder,
+        warmup=warmup,
+        readiness=readiness,
+        recorder=recorder,
+    )
+    settings_controller = OscSettingsController(
+        settings, prompt_embedder=prompt_embedder, warmup=warmup, recorder=recorder
+    )
 
-    receiver = ThreadedWebsocket(settings)
-    processor = Processor(settings, use_cached=args.use_cached).feed(receiver)
-    display = BroadcastStream(settings.output_port, settings, receiver).feed(processor)
+    batch_controller = None
+    if settings.adaptive_batch:
+        batch_controller = AdaptiveBatchController(settings)
+
+    result_cache = None
+    if settings.result_cache_mb > 0:
+        result_cache = ResultCache(settings.result_cache_mb * 1024 * 1024)
+
+    receiver = ThreadedWebsocket(
+        settings,
+        batch_controller=batch_controller,
+        result_cache=result_cache,
+        warmup=warmup,
+        recorder=recorder,
+        prompt_embedder=prompt_embedder,
+    )
+    processor = Processor(
+        settings,
+        use_cached=args.use_cached,
+        batch_controller=batch_controller,
+        prompt_embedder=prompt_embedder,
+        warmup=warmup,
+        readiness=readiness,
+        sessions=lambda: len(receiver.sessions),
+    ).feed(receiver)
+    encoder = EncodeStream(settings, result_cache=result_cache).feed(processor)
+    display = BroadcastStream(settings.output_port, settings, receiver).feed(encoder)
+
+    workers = [receiver, processor, encoder, display]
+    readiness.add_check("processor", processor.health)
+    readiness.add_source("queues", lambda: {w.name: w.queue_stats() for w in workers})
+    readiness.add_source(
+        "dropped_frames", lambda: {w.name: w.dropped_frames for w in workers}
+    )
+    readiness.add_source("sessions", lambda: len(receiver.sessions))
+    readiness.add_source(
+        "session_stats",
+        lambda: {
+            session.id: {
+                "frames_in": session.frames_in,
+                "frames_out": session.frames_out,
+                "seq_gaps": session.seq_gaps,
+                "replies_dropped": session.replies_dropped,
+            }
+            for session in list(receiver.sessions.values())
+        },
+    )
+    readiness.add_source("workers", lambda: {w.name: w.stats() for w in workers})
+
+    def queue_depths():
+        return {
+            (w.name, q): stats["size"]
+            for w in workers
+            for q, stats in w.queue_stats().items()
+        }
+
+    def dropped_frames():
+        values = {}
+        for w in workers:
+            stats = w.queue_stats().get("output_queue")
+            if stats is not None:
+                values[(w.name, "full")] = stats["dropped_full"]
+                values[(w.name, "stale")] = stats["dropped_stale"]
+        return values
+
+    def session_frames():
+        values = {}
+        for session in list(receiver.sessions.values()):
+            values[(session.id, "in")] = session.frames_in
+            values[(session.id, "out")] = session.frames_out
+        return values
+
+    REGISTRY.gauge(
+        "gendj_queue_depth",
+        "Items waiting in each queue between pipeline stages.",
+        ["worker", "queue"],
+        function=queue_depths,
+    )
+    REGISTRY.counter(
+        "gendj_dropped_frames_total",
+        "Items dropped by a worker's output queue, because it was full or items got too old.",
+        ["worker", "reason"],
+        function=dropped_frames,
+    )
+    REGISTRY.counter(
+        "gendj_session_frames_total",
+        "Frames received and sent per connected session.",
+        ["session", "direction"],
+        function=session_frames,
+    )
+    REGISTRY.counter(
+        "gendj_session_seq_gaps_total",
+        "Framed protocol frames that arrived out of sequence, per connected session.",
+        ["session"],
+        function=lambda: {
+            (session.id,): session.seq_gaps for session in list(receiver.sessions.values())
+        },
+    )
+    REGISTRY.gauge(
+        "gendj_worker_utilization",
+        "Fraction of each worker's loop spent in work() over its recent items.",
+        ["worker"],
+        function=lambda: {(w.name,): w.timings.utilization() for w in workers},
+    )
+    REGISTRY.gauge(
+        "gendj_worker_items_per_second",
+        "Items each worker completed per second over its recent items.",
+        ["worker"],
+        function=lambda: {(w.name,): w.timings.items_per_sec() for w in workers},
+    )
+    REGISTRY.gauge(
+        "gendj_sessions",
+        "Connected websocket sessions.",
+        function=lambda: len(receiver.sessions),
+    )
+    if result_cache is not None:
+        readiness.add_source("result_cache", result_cache.stats)
+        REGISTRY.counter(
+            "gendj_result_cache_total",
+            "Result cache lookups by result.",
+            ["result"],
+            function=lambda: {("hit",): result_cache.hits, ("miss",): result_cache.misses},
+        )
+        REGISTRY.gauge(
+            "gendj_result_cache_hit_ratio",
+            "Fraction of result cache lookups that found an encoded output.",
+            function=result_cache.hit_rate,
+        )
+        REGISTRY.gauge(
+            "gendj_result_cache_bytes",
+            "Encoded output bytes held by the result cache.",
+            function=lambda: result_cache.size,
+        )
 
     # Main program signal handling
     def signal_handler(signal, frame):
         print("Signal received, closing...")
-        components = [display, processor, receiver, settings_controller, settings_api]
+        components = [
+            display,
+            encoder,
+            processor,
+            receiver,
+            settings_controller,
+            settings_api,
+            prompt_embedder,
+            readiness,
+        ]
+        if recorder is not None:
+            components.append(recorder)
 
         for component in components:
             component_name = getattr(component, "name", component.__class__.__name__)
@@ -291,9 +793,12 @@ def main():
     signal.signal(signal.SIGTERM, signal_handler)
 
     # Start the components
+    readiness.start()
+    prompt_embedder.start()
     settings_api.start()
     settings_controller.start()
     display.start()
+    encoder.start()
     processor.start()
     receiver.start()
 
@@ -7,17 +7,42 @@ import subprocess
 import signal
 import socket
 import sys
+import json
 from http.server import HTTPServer, BaseHTTPRequestHandler
 
 # --- Health Check Server --- 
+# GenDJ writes its readiness state here every second (see readiness.py)
+STATUS_FILE = os.environ.get("STATUS_FILE", "/tmp/gendj-status.json")
+STATUS_MAX_AGE = 10  # seconds, an older file means the GenDJ process died
+
+def read_status():
+    # no file means the service was not started yet and the worker is free for a job
+    try:
+        with open(STATUS_FILE) as f:
+            status = json.load(f)
+    except FileNotFoundError:
+        return {"state": "idle", "ready": True}
+    except (OSError, ValueError) as e:
+        return {"state": "unknown", "ready": False, "error": str(e)}
+    if time.time() - status.get("updated", 0) > STATUS_MAX_AGE:
+        return {"state": "stale", "ready": False, "updated": status.get("updated")}
+    return status
+
 def run_health_server():
     class SimpleHealthCheckHandler(BaseHTTPRequestHandler):
+        def send_json(self, code, body):
+            self.send_response(code)
+            self.send_header("Content-type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps(body).encode("utf-8"))
+
         def do_GET(self):
             if self.path == "/readyz":
-                self.send_response(200)
-                self.send_header("Content-type", "text/plain")
-                self.end_headers()
-                self.wfile.write(b"OK")
+                status = read_status()
+                code = 200 if status.get("ready") else 503
+                self.send_json(code, {"state": status["state"], "problems": status.get("problems", {})})
+            elif self.path == "/status":
+                self.send_json(200, read_status())
             else:
                 self.send_response(404)
                 self.send_header("Content-type", "text/plain")
@@ -3,6 +3,7 @@ import torch
 from torch.nn import functional as F
 import ctypes
 import sdl2
+from fixed_size_dict import FixedSizeDict
 
 
 def get_texture_size(texture):
@@ -22,6 +23,40 @@ def unpack_rgb444_image(buffer, image_shape):
     return unpacked_image
 
 
+def quantize_batch(images):
+    # float NCHW in [0, 1] to uint8 NHWC, matching (image * 255).astype(np.uint8)
+    # on the float32 numpy output of the pipeline bit for bit
+    images = images.float().clamp(0, 1).mul(255).to(torch.uint8)
+    return images.permute(0, 2, 3, 1).contiguous()
+
+
+class PinnedBufferRing:
+    # reusable page-locked host buffers for device to host copies, one ring
+    # per shape since batches of each resolution and padded size alternate.
+    # a buffer is handed out again after `size` copies of its shape, so size
+    # must cover every batch that can still be in flight downstream. size 0
+    # allocates a new buffer per copy.
+    def __init__(self, size=4, shapes=8):
+        self.size = size
+        self.rings = FixedSizeDict(shapes)  # (shape, dtype) -> [buffers, next index]
+
+    def copy(self, tensor):
+        key = (tuple(tensor.shape), tensor.dtype)
+        if key not in self.rings:
+            self.rings[key] = [[], 0]
+        buffers, index = self.rings[key]
+        if len(buffers) < self.size or not self.size:
+            buffer = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+            if self.size:
+                buffers.append(buffer)
+        else:
+            buffer = buffers[index]
+            self.rings[key][1] = (index + 1) % self.size
+        buffer.copy_(tensor, non_blocking=True)
+        torch.cuda.current_stream(tensor.device).synchronize()
+        return buffer.numpy()
+
+
 def half_size_batch(batch):
     return F.interpolate(batch, scale_factor=0.5, mode="area")
 
@@ -0,0 +1,205 @@
+from bisect import bisect_left
+import math
+import threading
+
+# seconds, from a single decode up to a stalled batch
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in pairs) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class Metric:
+    # labels are passed as keyword arguments and must match labelnames.
+    # a metric with a function is read at scrape time instead of being
+    # updated by the code, the function returns a number or a dict of label
+    # value tuples to numbers.
+    type = None
+
+    def __init__(self, name, help, labelnames=(), function=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def items(self):
+        if self.function is None:
+            with self.lock:
+                return list(self.values.items())
+        values = self.function()
+        if isinstance(values, dict):
+            return [(tuple(str(e) for e in k), v) for k, v in values.items()]
+        return [((), values)]
+
+    def samples(self):
+        for key, value in self.items():
+            yield self.name, format_labels(self.labelnames, key), value
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    # (count, sum) of the observations with these labels
+    def totals(self, **labels):
+        key = self.key(labels)
+        with self.lock:
+            entry = self.values.get(key)
+            return (entry[2], entry[1]) if entry is not None else (0, 0.0)
+
+    def samples(self):
+        with self.lock:
+            items = [(k, (list(c), s, n)) for k, (c, s, n) in self.values.items()]
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = format_labels(self.labelnames, key, [("le", format_value(bound))])
+                yield f"{self.name}_bucket", le, cumulative
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                # collector functions are re-registered when a component restarts
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered as {existing.type}")
+                existing.function = metric.function
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames=(), function=None):
+        return self.register(Counter(name, help, labelnames, function))
+
+    def gauge(self, name, help, labelnames=(), function=None):
+        return self.register(Gauge(name, help, labelnames, function))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    # prometheus text format 0.0.4
+    def exposition(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        blocks = []
+        for metric in metrics:
+            try:
+                blocks.append(metric.exposition())
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+        return "\n".join(blocks) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "gendj_stage_seconds",
+    "Time spent per frame or batch in each pipeline stage.",
+    ["stage"],
+)
+FRAME_LATENCY = REGISTRY.histogram(
+    "gendj_frame_latency_seconds",
+    "Time from receiving a frame to sending its result.",
+)
+FRAMES = REGISTRY.counter(
+    "gendj_frames_total",
+    "Frames received and sent over all sessions.",
+    ["direction"],
+)
+PROMPT_CACHE = REGISTRY.counter(
+    "gendj_prompt_cache_total",
+    "Prompt embedding lookups by cache level and result.",
+    ["cache", "result"],
+)
+
+
+def prompt_cache_hit_rate():
+    with PROMPT_CACHE.lock:
+        values = dict(PROMPT_CACHE.values)
+    rates = {}
+    for cache in ("memory", "disk"):
+        hits = values.get((cache, "hit"), 0)
+        total = hits + values.get((cache, "miss"), 0)
+        rates[(cache,)] = hits / total if total else 0
+    return rates
+
+
+REGISTRY.gauge(
+    "gendj_prompt_cache_hit_ratio",
+    "Fraction of prompt embedding lookups served by each cache level.",
+    ["cache"],
+    function=prompt_cache_hit_rate,
+)
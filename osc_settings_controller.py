@@ -1,28 +1,30 @@
 from threaded_worker import ThreadedWorker
 from osc_socket import OscSocket
 from pythonosc import osc_packet
+from prompt_blend import make_blend, make_mix, BLEND_MODES
+from prompt_embedder import PromptEmbedder
+from warmup_spec import WarmupSpec
 
 class OscSettingsController(ThreadedWorker):
-    def __init__(self, settings):
+    def __init__(self, settings, prompt_embedder=None, warmup=None, recorder=None):
         super().__init__(has_input=False, has_output=False)
         address = f"0.0.0.0:{settings.osc_port}"
         print(self.name, f"connecting to OSC on {address}")
-        self.osc = OscSocket("0.0.0.0", settings.osc_port)
+        self.osc = OscSocket("0.0.0.0", settings.osc_port, recorder=recorder)
         self.settings = settings
+        # an embedder that is never attached applies prompts right away
+        if prompt_embedder is None:
+            prompt_embedder = PromptEmbedder(settings)
+        self.prompt_embedder = prompt_embedder
+        self.warmup = warmup if warmup is not None else WarmupSpec.from_settings(settings)
         self.prompt_0 = ""
         self.prompt_1 = ""
         self.blend = 0.5
         
     def update_blend(self):
-        if self.blend == 0:
-            self.settings.prompt = self.prompt_0
-        elif self.blend == 1:
-            self.settings.prompt = self.prompt_1
-        else:
-            a = self.prompt_0
-            b = self.prompt_1
-            t = self.blend
-            self.settings.prompt = f'("{a}", "{b}").blend({1-t:.2f}, {t:.2f})'
+        self.prompt_embedder.submit(
+            make_blend(self.prompt_0, self.prompt_1, self.blend, self.settings.blend_mode)
+        )
         
     def work(self):
         try:
@@ -32,7 +34,7 @@ class OscSettingsController(ThreadedWorker):
             if msg.address == "/prompt":
                 prompt = ' '.join(msg.params)
                 # print("OSC prompt:", prompt)
-                self.settings.prompt = prompt
+                self.prompt_embedder.submit(prompt)
                 
             elif msg.address == "/blend":
                 a, b, t = msg.params
@@ -49,6 +51,15 @@ class OscSettingsController(ThreadedWorker):
             elif msg.address == "/blend_t":
                 self.blend = float(msg.params[0])
                 self.update_blend()
+            elif msg.address == "/mix":
+                # prompt, weight pairs: /mix "a" 0.5 "b" 0.3 "c" 0.2
+                prompts = [str(p) for p in msg.params[0::2]]
+                weights = [float(w) for w in msg.params[1::2]]
+                self.prompt_embedder.submit(make_mix(prompts, weights, self.settings.blend_mode))
+            elif msg.address == "/blend_mode":
+                mode = msg.params[0]
+                if mode in BLEND_MODES:
+                    self.settings.blend_mode = mode
                 
             elif msg.address == "/seed":
                 seed = msg.params[0]
@@ -61,10 +72,10 @@ class OscSettingsController(ThreadedWorker):
             elif msg.address == "/mode":
                 mode = msg.params[0]
                 if mode == "soft":
-                    self.settings.num_inference_steps = 3
+                    self.warmup.apply(self.settings, steps=3)
                     self.settings.strength = 0.5
                 elif mode == "hard":
-                    self.settings.num_inference_steps = 2
+                    self.warmup.apply(self.settings, steps=2)
                     self.settings.strength = 0.7               
             # else:
                 # print("unknown osc", msg.address, msg.params)
@@ -2,8 +2,9 @@ import socket
 from pythonosc import osc_packet
 
 class OscSocket:
-    def __init__(self, host, port, timeout=0.1):
+    def __init__(self, host, port, timeout=0.1, recorder=None):
         print(f"OSC listening on {host}:{port}")
+        self.recorder = recorder
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.bind((host, port))
         self.sock.settimeout(timeout)
@@ -13,6 +14,8 @@ class OscSocket:
             data, addr = self.sock.recvfrom(65535)
         except socket.timeout:
             return None
+        if self.recorder is not None:
+            self.recorder.osc(data)
         packet = osc_packet.OscPacket(data)
         for message in packet.messages:
             return message.message
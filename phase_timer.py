@@ -0,0 +1,29 @@
+import time
+from contextlib import contextmanager
+
+
+class PhaseTimer:
+    # wall time per named startup phase, in the order they ran
+    def __init__(self):
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.time() - start_time))
+
+    def total(self):
+        return sum(duration for name, duration in self.phases)
+
+    def as_dict(self):
+        return dict(self.phases)
+
+    def report(self):
+        lines = ["Startup timing:"]
+        for name, duration in self.phases:
+            lines.append(f"  {name:<16}{duration:8.2f}s")
+        lines.append(f"  {'total':<16}{self.total():8.2f}s")
+        return "\n".join(lines)
@@ -0,0 +1,73 @@
+import glob
+import importlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from diffusers import StableDiffusionXLImg2ImgPipeline, AutoencoderTiny
+
+
+def has_safetensors(path):
+    return bool(glob.glob(os.path.join(path, "*.safetensors")))
+
+
+def load_component(path, library, class_name, dtype, variant):
+    component_class = getattr(importlib.import_module(library), class_name)
+    if not issubclass(component_class, torch.nn.Module):
+        return component_class.from_pretrained(path)  # tokenizers and schedulers
+    use_safetensors = has_safetensors(path)
+    if not use_safetensors:
+        print(f"No safetensors in {path}, falling back to pickled weights")
+    return component_class.from_pretrained(
+        path,
+        torch_dtype=dtype,
+        variant=variant if use_safetensors else None,
+        use_safetensors=use_safetensors,
+        low_cpu_mem_usage=True,
+    )
+
+
+def load_vae(path, dtype):
+    return AutoencoderTiny.from_pretrained(
+        path,
+        torch_dtype=dtype,
+        use_safetensors=has_safetensors(path),
+        local_files_only=True,
+    )
+
+
+def load_pipeline(base_dir, vae_dir=None, dtype=torch.float16, variant="fp16", workers=4):
+    # loads the components of a pipeline saved with save_pretrained
+    # concurrently. safetensors weights are memory mapped, so most of the
+    # time goes to page faults and dtype copies that overlap across threads.
+    with open(os.path.join(base_dir, "model_index.json")) as f:
+        model_index = json.load(f)
+
+    config = {}
+    specs = {}
+    for name, value in model_index.items():
+        if name.startswith("_"):
+            continue
+        if isinstance(value, list):
+            specs[name] = value
+        else:
+            config[name] = value  # e.g. force_zeros_for_empty_prompt
+
+    components = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for name, (library, class_name) in specs.items():
+            if library is None:
+                components[name] = None  # optional component that was not saved
+            elif name == "vae" and vae_dir is not None:
+                futures[name] = pool.submit(load_vae, vae_dir, dtype)
+            else:
+                path = os.path.join(base_dir, name)
+                futures[name] = pool.submit(
+                    load_component, path, library, class_name, dtype, variant
+                )
+        for name, future in futures.items():
+            components[name] = future.result()
+
+    return StableDiffusionXLImg2ImgPipeline(**components, **config)
@@ -0,0 +1,47 @@
+BLEND_MODES = ("linear", "slerp")
+
+
+class PromptBlend:
+    # weighted blend of prompts, kept structured from the controllers to
+    # DiffusionProcessor. weights are quantized to 1/resolution so blends that
+    # only differ by slider jitter share one cached embedding.
+    resolution = 100
+
+    def __init__(self, prompts, weights, mode="linear"):
+        if len(prompts) != len(weights):
+            raise ValueError("PromptBlend needs one weight per prompt")
+        if mode not in BLEND_MODES:
+            raise ValueError(f"Unknown blend mode: {mode}")
+        self.prompts = tuple(prompts)
+        self.weights = tuple(round(float(w) * self.resolution) / self.resolution for w in weights)
+        self.mode = mode
+
+    def key(self):
+        return self.prompts, self.weights, self.mode
+
+    def __eq__(self, other):
+        return isinstance(other, PromptBlend) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __repr__(self):
+        return f"PromptBlend({self.prompts!r}, {self.weights!r}, {self.mode!r})"
+
+
+def make_mix(prompts, weights, mode="linear"):
+    # drops unweighted prompts, a single prompt at full weight stays a plain string
+    if len(prompts) != len(weights):
+        raise ValueError(
+            f"A prompt mix needs one weight per prompt, got {len(prompts)} and {len(weights)}"
+        )
+    mix = [(p, w) for p, w in zip(prompts, weights) if w != 0]
+    if not mix:
+        raise ValueError("A prompt mix needs at least one non-zero weight")
+    if len(mix) == 1 and mix[0][1] == 1:
+        return mix[0][0]
+    return PromptBlend([p for p, w in mix], [w for p, w in mix], mode)
+
+
+def make_blend(prompt_0, prompt_1, t, mode="linear"):
+    return make_mix((prompt_0, prompt_1), (1 - t, t), mode)
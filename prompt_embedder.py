@@ -0,0 +1,62 @@
+import threading
+import torch
+from threaded_worker import ThreadedWorker
+
+
+class PromptEmbedder(ThreadedWorker):
+    # embeds a new prompt on its own thread and CUDA stream, and only makes it
+    # the active settings.prompt (or a session's prompt override) once the
+    # embedding is cached, so inference never blocks on the text encoders.
+    # until a DiffusionProcessor is attached, prompts are applied right away
+    # and embedded during warmup.
+    def __init__(self, settings):
+        super().__init__(has_input=True, has_output=False)
+        self.settings = settings
+        self.diffusion_processor = None
+        self.stream = None
+        self.latest = {}  # session id, None for the shared prompt -> newest prompt
+        self.lock = threading.Lock()
+
+    def attach(self, diffusion_processor):
+        self.diffusion_processor = diffusion_processor
+
+    def submit(self, prompt, session=None):
+        if self.diffusion_processor is None:
+            self.apply(prompt, session)
+            return
+        with self.lock:
+            self.latest[getattr(session, "id", None)] = prompt
+        self.input_queue.put((prompt, session))
+
+    def apply(self, prompt, session):
+        if session is None:
+            self.settings.prompt = prompt
+        else:
+            session.prompt = prompt
+
+    def setup(self):
+        if torch.cuda.is_available():
+            self.stream = torch.cuda.Stream()
+
+    def work(self, args):
+        prompt, session = args
+        target = getattr(session, "id", None)
+        if prompt is not self.latest.get(target):
+            return  # superseded by a newer prompt while queued
+        try:
+            if self.stream is not None:
+                with torch.cuda.stream(self.stream):
+                    self.diffusion_processor.meta_embed_prompt(prompt)
+                self.stream.synchronize()
+            else:
+                self.diffusion_processor.meta_embed_prompt(prompt)
+        except Exception as e:
+            print(f"Error embedding prompt {prompt!r}: {e}")
+            with self.lock:
+                if prompt is self.latest.get(target):
+                    del self.latest[target]
+            return
+        with self.lock:
+            if prompt is self.latest.get(target):
+                del self.latest[target]
+                self.apply(prompt, session)
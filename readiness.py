@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+
+LOADING = "loading"
+COMPILING = "compiling"
+WARMING = "warming"
+READY = "ready"
+DEGRADED = "degraded"
+STATES = (LOADING, COMPILING, WARMING, READY, DEGRADED)
+
+
+class Readiness:
+    # startup progress and serving health shared by the pipeline threads.
+    # startup moves loading -> compiling -> warming -> ready. once ready the
+    # state is degraded whenever a check reports a problem, e.g. a stalled
+    # Processor, and for good once a startup step failed. the status is
+    # written to a json file every interval for the health check servers,
+    # which run outside this process.
+    def __init__(self, path=None, interval=1.0, stall_timeout=5.0):
+        self.path = path
+        self.interval = interval
+        self.stall_timeout = stall_timeout
+        self.state = LOADING
+        self.since = time.time()
+        self.started = time.time()
+        self.last_batch = None
+        self.batches = 0
+        self.sources = {}  # name -> callable returning extra status
+        self.checks = {}  # name -> callable returning a problem or None
+        self.errors = {}  # name -> startup failure, keeps the state degraded
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def set_state(self, state):
+        if state not in STATES:
+            raise ValueError(f"Unknown readiness state: {state}")
+        with self.lock:
+            if state == self.state:
+                return
+            self.state = state
+            self.since = time.time()
+        print(f"Readiness: {state}", flush=True)
+
+    # a startup step that raised, startup will not reach ready from here
+    def fail(self, name, error):
+        self.errors[name] = str(error)
+        self.set_state(DEGRADED)
+
+    def batch_done(self):
+        self.last_batch = time.time()
+        self.batches += 1
+
+    def add_source(self, name, source):
+        self.sources[name] = source
+
+    def add_check(self, name, check):
+        self.checks[name] = check
+
+    def last_batch_age(self):
+        if self.last_batch is None:
+            return None
+        return time.time() - self.last_batch
+
+    def problems(self):
+        problems = dict(self.errors)
+        for name, check in self.checks.items():
+            try:
+                problem = check()
+            except Exception as e:
+                problem = f"check failed: {e}"
+            if problem:
+                problems[name] = problem
+        return problems
+
+    def evaluate(self):
+        problems = {}
+        if self.state in (READY, DEGRADED):
+            problems = self.problems()
+            self.set_state(DEGRADED if problems else READY)
+        return self.state, problems
+
+    def ready(self):
+        return self.evaluate()[0] == READY
+
+    def status(self):
+        state, problems = self.evaluate()
+        cur_time = time.time()
+        status = {
+            "state": state,
+            "ready": state == READY,
+            "since": self.since,
+            "uptime": cur_time - self.started,
+            "updated": cur_time,
+            "batches": self.batches,
+            "last_batch_age": self.last_batch_age(),
+            "problems": problems,
+        }
+        for name, source in self.sources.items():
+            try:
+                status[name] = source()
+            except Exception as e:
+                status[name] = f"unavailable: {e}"
+        return status
+
+    def write(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.status(), f, default=str)
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        if self.path and not self.thread.is_alive():
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.write()
+            except Exception as e:
+                print(f"Error writing status file: {e}")
+            self.stop_event.wait(self.interval)
+
+    def close(self):
+        self.stop_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout=2)
+        # a missing file means no service is running, a stale one that it died
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
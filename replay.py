@@ -0,0 +1,208 @@
+import argparse
+import asyncio
+import socket
+import time
+import urllib.request
+
+import websockets
+
+import frame_protocol
+from session_recorder import read_records, parse_http, OPEN, CLOSE, FRAME, TEXT, OSC, HTTP
+
+
+def percentiles(values, qs=(50, 95, 99)):
+    values = sorted(values)
+    if not values:
+        return {q: 0 for q in qs}
+    return {q: values[min(len(values) - 1, int(len(values) * q / 100))] for q in qs}
+
+
+class ClientResults:
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latency = []  # ms, capture to reply, all on this machine's clock
+        self.ingest = []  # ms, capture to server receive
+        self.server = []  # ms, server receive to send
+        self.returned = []  # ms, server send to reply
+
+    def record(self, header, now):
+        self.received += 1
+        self.latency.append(now - header.capture)
+        self.ingest.append(header.received - header.capture)
+        self.server.append(header.sent - header.received)
+        self.returned.append(now - header.sent)
+
+
+class Replayer:
+    # plays a session recording back against a running server: websocket
+    # sessions, OSC datagrams and SettingsAPI requests, in recorded order.
+    # speed 1 keeps the original timing, 2 plays twice as fast and 0 sends
+    # without waiting. framed frames get a fresh capture time so latency can
+    # be measured, with framed=True plain JPEG frames get a header too.
+    def __init__(
+        self,
+        path,
+        host="localhost",
+        websocket_port=8765,
+        settings_port=5556,
+        osc_port=9091,
+        speed=1.0,
+        control=True,
+        framed=False,
+        drain=1.0,
+    ):
+        self.path = path
+        self.url = f"ws://{host}:{websocket_port}"
+        self.settings_url = f"http://{host}:{settings_port}"
+        self.osc_address = (host, osc_port)
+        self.osc = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.speed = speed
+        self.control = control
+        self.framed = framed
+        self.drain = drain
+        self.sessions = {}  # recorded session id -> (websocket, reader task)
+        self.results = {}  # recorded session id -> ClientResults
+        self.seq = 0
+        self.controls = 0
+        self.skipped = 0
+        self.elapsed = 0
+
+    async def connect(self, session_id):
+        # ids restart with every server run, a file may hold several runs
+        await self.disconnect(session_id)
+        websocket = await websockets.connect(self.url, max_size=None)
+        results = self.results.setdefault(session_id, ClientResults())
+        reader = asyncio.create_task(self.read(websocket, results))
+        self.sessions[session_id] = (websocket, reader)
+        return websocket
+
+    async def read(self, websocket, results):
+        try:
+            async for message in websocket:
+                header, payload = frame_protocol.parse(message)
+                if header is not None:
+                    results.record(header, frame_protocol.now_ms())
+                else:
+                    results.received += 1
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def disconnect(self, session_id):
+        entry = self.sessions.pop(session_id, None)
+        if entry is None:
+            return
+        websocket, reader = entry
+        await websocket.close()
+        await asyncio.gather(reader, return_exceptions=True)
+
+    def retime(self, payload):
+        header, jpeg = frame_protocol.parse(payload)
+        if header is None:
+            if not self.framed:
+                return payload
+            header = frame_protocol.FrameHeader(self.seq)
+            self.seq += 1
+        header.capture = frame_protocol.now_ms()
+        header.received = header.inferred = header.sent = 0
+        return header.pack() + bytes(jpeg)
+
+    def http(self, payload):
+        method, path, body = parse_http(payload)
+        request = urllib.request.Request(
+            self.settings_url + path, data=body or None, method=method
+        )
+        if body:
+            request.add_header("Content-Type", "application/json")
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                response.read()
+        except OSError as e:
+            print(f"Replayed {method} {path} failed: {e}")
+
+    async def dispatch(self, record):
+        kind = record.kind
+        if kind == OPEN:
+            await self.connect(record.session_id)
+        elif kind == CLOSE:
+            await self.disconnect(record.session_id)
+        elif kind in (FRAME, TEXT):
+            entry = self.sessions.get(record.session_id)
+            websocket = entry[0] if entry else await self.connect(record.session_id)
+            if kind == TEXT:
+                message = record.payload.decode("utf-8")
+            else:
+                message = self.retime(record.payload)
+                self.results[record.session_id].sent += 1
+            try:
+                await websocket.send(message)
+            except websockets.exceptions.ConnectionClosed:
+                print(f"Session {record.session_id} closed by the server")
+        elif not self.control:
+            self.skipped += 1
+        elif kind == OSC:
+            self.osc.sendto(record.payload, self.osc_address)
+            self.controls += 1
+        elif kind == HTTP:
+            # waited for, so later frames see the change like they did live
+            await asyncio.get_running_loop().run_in_executor(None, self.http, record.payload)
+            self.controls += 1
+
+    async def play(self):
+        start = None
+        for record in read_records(self.path):
+            if start is None:
+                start = (record.time, time.time())
+            if self.speed > 0:
+                due = start[1] + (record.time - start[0]) / self.speed
+                delay = due - time.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await self.dispatch(record)
+        self.elapsed = time.time() - start[1] if start else 0
+        await asyncio.sleep(self.drain)  # replies still in flight
+        for session_id in list(self.sessions):
+            await self.disconnect(session_id)
+        self.osc.close()
+
+    def print_report(self):
+        elapsed = self.elapsed or 1
+        print(f"Replayed {self.path} in {self.elapsed:.1f}s, {self.controls} control events")
+        if self.skipped:
+            print(f"  skipped {self.skipped} control events")
+        for session_id, results in self.results.items():
+            line = f"  session {session_id}: sent {results.sent} ({results.sent / elapsed:.1f} fps), received {results.received}"
+            if results.latency:
+                p = percentiles(results.latency)
+                line += f", latency p50 {p[50]:.1f}ms p95 {p[95]:.1f}ms p99 {p[99]:.1f}ms"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a session recording against a running GenDJ.")
+    parser.add_argument("recording", help="file written with the record_file setting")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--websocket_port", type=int, default=8765)
+    parser.add_argument("--settings_port", type=int, default=5556)
+    parser.add_argument("--osc_port", type=int, default=9091)
+    parser.add_argument("--speed", type=float, default=1.0, help="2 plays twice as fast, 0 as fast as possible")
+    parser.add_argument("--no_control", action="store_true", help="only replay websocket sessions")
+    parser.add_argument("--framed", action="store_true", help="add a header to plain JPEG frames to measure latency")
+    args = parser.parse_args()
+
+    replayer = Replayer(
+        args.recording,
+        host=args.host,
+        websocket_port=args.websocket_port,
+        settings_port=args.settings_port,
+        osc_port=args.osc_port,
+        speed=args.speed,
+        control=not args.no_control,
+        framed=args.framed,
+    )
+    asyncio.run(replayer.play())
+    replayer.print_report()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    # LRU of encoded output frames, keyed by a hash of the input jpeg and the
+    # generation parameters, bounded by the total size of the stored bytes.
+    # looped video sources send the same frames again and hit here instead of
+    # going through decode, inference and encode.
+    def __init__(self, max_bytes):
+        self.store = OrderedDict()
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(frame_data, settings):
+        fingerprint = hashlib.blake2b(frame_data, digest_size=16).digest()
+        return (
+            fingerprint,
+            settings.prompt,
+            settings.seed,
+            settings.num_inference_steps,
+            settings.strength,
+        )
+
+    def get(self, key):
+        with self.lock:
+            value = self.store.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.store.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.store.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.store[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.store.popitem(last=False)
+                self.size -= len(evicted)
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0
+
+    def stats(self):
+        return {
+            "entries": len(self.store),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate(),
+        }
@@ -0,0 +1,88 @@
+from array import array
+import time
+
+
+class RingStats:
+    # the last size samples in a preallocated array('d'), so recording is a
+    # store and an index bump. percentiles sort a copy when asked for.
+    def __init__(self, size=128):
+        self.size = size
+        self.values = array("d", bytes(8 * size))
+        self.index = 0
+        self.count = 0  # samples recorded in total, can exceed size
+
+    def add(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.count += 1
+
+    def samples(self):
+        # oldest first
+        if self.count < self.size:
+            return self.values[: self.index].tolist()
+        return (self.values[self.index :] + self.values[: self.index]).tolist()
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def total(self):
+        return sum(self.samples())
+
+    def mean(self):
+        n = len(self)
+        return self.total() / n if n else 0
+
+    def percentiles(self, qs=(50, 95, 99)):
+        values = sorted(self.samples())
+        if not values:
+            return {q: 0 for q in qs}
+        # nearest rank
+        return {q: values[min(len(values) - 1, int(len(values) * q / 100))] for q in qs}
+
+    def summary(self):
+        p = self.percentiles()
+        return {"mean": self.mean(), "p50": p[50], "p95": p[95], "p99": p[99]}
+
+
+class WorkerStats:
+    # per item timings of a ThreadedWorker loop: wait is time blocked on the
+    # input queue, busy is work() wall time, cpu is work() thread cpu time
+    # and put is time blocked on the output queue.
+    def __init__(self, size=128):
+        self.wait = RingStats(size)
+        self.busy = RingStats(size)
+        self.cpu = RingStats(size)
+        self.put = RingStats(size)
+        self.done = RingStats(size)  # completion timestamps, for the rate
+        self.items = 0
+
+    def record(self, wait, busy, cpu, put):
+        self.wait.add(wait)
+        self.busy.add(busy)
+        self.cpu.add(cpu)
+        self.put.add(put)
+        self.done.add(time.time())
+        self.items += 1
+
+    def items_per_sec(self):
+        done = self.done.samples()
+        if len(done) < 2 or done[-1] <= done[0]:
+            return 0
+        return (len(done) - 1) / (done[-1] - done[0])
+
+    def utilization(self):
+        # fraction of the loop spent in work() over the recorded window
+        busy = self.busy.total()
+        loop = busy + self.wait.total() + self.put.total()
+        return busy / loop if loop else 0
+
+    def summary(self):
+        return {
+            "items": self.items,
+            "items_per_sec": self.items_per_sec(),
+            "utilization": self.utilization(),
+            "busy": self.busy.summary(),
+            "cpu": self.cpu.summary(),
+            "wait": self.wait.summary(),
+            "put": self.put.summary(),
+        }
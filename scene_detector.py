@@ -0,0 +1,41 @@
+import time
+import numpy as np
+
+
+class StaticSceneDetector:
+    # cheap per-session change detector. each decoded frame is reduced to a
+    # small grayscale thumbnail and compared with the last frame that went to
+    # inference. frames below threshold (mean absolute difference, 0-1) with
+    # unchanged settings are static and can reuse the previous output. a full
+    # inference still runs every refresh_interval seconds.
+    def __init__(self, threshold, refresh_interval=1.0, size=32):
+        self.threshold = threshold
+        self.refresh_interval = refresh_interval
+        self.size = size
+        self.reference = None
+        self.reference_key = None
+        self.last_refresh = 0
+        self.static_frames = 0
+
+    def thumbnail(self, frame):
+        # frame is HxWx3 uint8, strided subsampling keeps this well under 1ms
+        h, w = frame.shape[:2]
+        small = frame[:: max(h // self.size, 1), :: max(w // self.size, 1)]
+        return small.mean(axis=2, dtype=np.float32)
+
+    def is_static(self, thumbnail, settings_key):
+        cur_time = time.time()
+        if (
+            self.reference is not None
+            and thumbnail.shape == self.reference.shape
+            and settings_key == self.reference_key
+            and cur_time - self.last_refresh < self.refresh_interval
+        ):
+            diff = float(np.abs(thumbnail - self.reference).mean()) / 255
+            if diff < self.threshold:
+                self.static_frames += 1
+                return True
+        self.reference = thumbnail
+        self.reference_key = settings_key
+        self.last_refresh = cur_time
+        return False
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import time
+from scene_detector import StaticSceneDetector
+
+# settings a client may override for its own session over the websocket
+SESSION_SETTINGS = ("prompt", "seed", "strength", "num_inference_steps", "mirror")
+
+
+def parse_setting(value, current):
+    # cast to the type of the current value, bool("false") would be True
+    if isinstance(current, bool):
+        if isinstance(value, str):
+            if value.lower() in ("true", "1", "yes", "on"):
+                return True
+            if value.lower() in ("false", "0", "no", "off"):
+                return False
+            raise ValueError(f"Not a boolean: {value!r}")
+        return bool(value)
+    return type(current)(value)
+
+
+def check_setting(key, value):
+    # values the pipeline would fail on, raising there stops every session
+    if key == "num_inference_steps" and value < 1:
+        raise ValueError(f"num_inference_steps must be at least 1, got {value}")
+    if key == "seed" and not 0 <= value < 2**64:
+        raise ValueError(f"seed must fit in 64 unsigned bits, got {value}")
+    if key == "strength" and not 0 <= value <= 1:
+        raise ValueError(f"strength must be between 0 and 1, got {value}")
+    return value
+
+
+class FrameInfo:
+    # metadata that travels with a frame from ingest until it is sent back.
+    # header is set when the client uses the framed protocol
+    def __init__(self, session_id, settings, header=None):
+        self.session_id = session_id
+        self.settings = settings
+        self.header = header
+        self.received = time.time()
+        self.queued = None  # handed to the BatchScheduler after decoding
+        self.inferred = None
+        self.cache_key = None  # set when the result should go into the ResultCache
+        self.trace = None  # trace id when this frame was sampled for tracing
+        self.index = None  # position in its session's stream of frames
+
+
+class Session:
+    ids = itertools.count(1)
+
+    def __init__(self, websocket, settings, prompt_embedder=None):
+        self.id = next(Session.ids)
+        self.websocket = websocket
+        self.settings = settings
+        self.prompt_embedder = prompt_embedder
+        self.overrides = {}
+        self.prompt = None  # prompt override, set once its embedding is cached
+        self.frames_in = 0
+        self.frames_out = 0
+        self.last_seq = None
+        self.seq_gaps = 0  # framed protocol frames that arrived out of sequence
+        self.last_output = None  # last jpeg sent, reused for static frames
+        self.last_dispatched = 0  # index of the last frame handed to decoding
+        self.last_queued = 0  # index of the last frame handed to inference
+        self.last_replied = 0  # index of the last frame whose reply was queued
+        self.size = None  # (height, width) its frames are inferred at
+        # replies waiting to be sent, drained by the session's own sender task
+        self.outbox = asyncio.Queue()
+        self.outbox_size = settings.frame_queue_size
+        self.replies_dropped = 0  # dropped because the client did not keep up
+        self.scene = None
+        if settings.static_threshold > 0:
+            self.scene = StaticSceneDetector(
+                settings.static_threshold, settings.static_refresh
+            )
+        self.created = time.time()
+
+    # nothing handed to inference (or to decoding, with dispatched) is still
+    # unanswered, so a reused output can't overtake an older reply. a frame
+    # dropped on the way only holds this up until a later one comes back
+    def caught_up(self, dispatched=False):
+        last = self.last_dispatched if dispatched else self.last_queued
+        return self.last_replied >= last
+
+    def check_sequence(self, seq):
+        if self.last_seq is not None and seq != self.last_seq + 1:
+            self.seq_gaps += 1
+        self.last_seq = seq
+
+    # raises ValueError, TypeError or AttributeError on a malformed message,
+    # in which case none of its values are applied
+    def update(self, values):
+        overrides = {}
+        prompt = None
+        for key, value in values.items():
+            if key not in SESSION_SETTINGS:
+                print(f"Session {self.id}: ignoring setting {key}")
+                continue
+            if key == "prompt":
+                if self.settings.safety:
+                    # SettingsAPI checks its prompts, a session can't bypass that
+                    raise ValueError("prompt overrides are disabled while safety is on")
+                prompt = str(value)
+            else:
+                value = parse_setting(value, getattr(self.settings, key))
+                overrides[key] = check_setting(key, value)
+        self.overrides.update(overrides)
+        if prompt is None:
+            return
+        if self.prompt_embedder is not None:
+            self.prompt_embedder.submit(prompt, session=self)
+        else:
+            self.prompt = prompt
+
+    # snapshot of the shared settings with this session's overrides applied
+    def current_settings(self):
+        overrides = self.overrides
+        if self.prompt is not None:
+            overrides = dict(overrides, prompt=self.prompt)
+        return self.settings.copy(update=overrides)
+
+    # what must stay the same for a previous output to be reused
+    @staticmethod
+    def settings_key(settings):
+        return (
+            settings.prompt,
+            settings.seed,
+            settings.strength,
+            settings.num_inference_steps,
+            settings.mirror,
+        )
+
+    def __repr__(self):
+        return f"Session({self.id}, in={self.frames_in}, out={self.frames_out})"
@@ -0,0 +1,120 @@
+from collections import namedtuple
+import re
+import struct
+import threading
+import time
+
+# append-only recording of everything that reaches the server. the file
+# starts with MAGIC, then one record after another: a RECORD header followed
+# by length payload bytes. frames are stored exactly as received (framed
+# header included, if the client sent one), so nothing is re-encoded.
+MAGIC = b"GDJREC1\n"
+RECORD = struct.Struct("<BdII")  # kind, time (seconds since the epoch), session, length
+
+OPEN = 1  # websocket session connected, empty payload
+CLOSE = 2  # websocket session closed, empty payload
+FRAME = 3  # binary websocket message
+TEXT = 4  # text websocket message (per-session settings), utf-8
+OSC = 5  # raw OSC datagram
+HTTP = 6  # SettingsAPI request: method, path with query and body joined by newlines
+
+Record = namedtuple("Record", "kind time session_id payload")
+
+
+class Recorder:
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.flush_interval = flush_interval
+        self.last_flush = time.time()
+        self.records = 0
+        print(f"Recording sessions to {path}")
+
+    def write(self, kind, session_id, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        header = RECORD.pack(kind, timestamp, session_id, len(payload))
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(header)
+            self.file.write(payload)
+            self.records += 1
+            if timestamp - self.last_flush > self.flush_interval:
+                self.file.flush()
+                self.last_flush = timestamp
+
+    def open_session(self, session_id):
+        self.write(OPEN, session_id, b"")
+
+    def close_session(self, session_id):
+        self.write(CLOSE, session_id, b"")
+
+    def message(self, session_id, message, timestamp=None):
+        if isinstance(message, str):
+            self.write(TEXT, session_id, message.encode("utf-8"), timestamp)
+        else:
+            self.write(FRAME, session_id, message, timestamp)
+
+    def osc(self, datagram):
+        self.write(OSC, 0, datagram)
+
+    def http(self, method, path, body):
+        self.write(HTTP, 0, b"\n".join([method.encode(), path.encode(), body]))
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                print(f"Recorded {self.records} records to {self.path}")
+
+
+def read_records(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a GenDJ recording")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return  # end of file, or a record cut off by a crash
+            kind, timestamp, session_id, length = RECORD.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            yield Record(kind, timestamp, session_id, payload)
+
+
+def parse_http(payload):
+    method, path, body = payload.split(b"\n", 2)
+    return method.decode(), path.decode(), body
+
+
+class RecordingMiddleware:
+    # ASGI middleware for SettingsAPI. records each request to a control
+    # route once it completed, with the body as the endpoint read it.
+    # reads like /status or /metrics are not part of the routes.
+    def __init__(self, app, recorder, routes):
+        self.app = app
+        self.recorder = recorder
+        self.routes = [re.compile(route) if isinstance(route, str) else route for route in routes]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not any(r.match(scope["path"]) for r in self.routes):
+            return await self.app(scope, receive, send)
+        body = []
+
+        async def recording_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        await self.app(scope, recording_receive, send)
+        # raw_path keeps the percent encoding, prompts in paths contain spaces
+        path = scope.get("raw_path", b"").decode("latin-1") or scope["path"]
+        if scope.get("query_string"):
+            path += "?" + scope["query_string"].decode("latin-1")
+        self.recorder.http(scope["method"], path, b"".join(body))
@@ -1,4 +1,6 @@
+from typing import Union
 from pydantic.v1 import BaseSettings, Field
+from prompt_blend import PromptBlend
 
 
 class Settings(BaseSettings):
@@ -19,18 +21,46 @@ class Settings(BaseSettings):
 
     safety: bool = Field(default=False)
     local_files_only: bool = Field(default=False)
-    warmup: str = Field(default=None)
+    warmup: str = Field(default=None)  # BxHxWxC[@steps] entries separated by commas
+    warmup_on_demand: bool = Field(default=True)  # warm cold shapes between sessions instead of only snapping
+    load_workers: int = Field(default=4)  # threads loading cached pipeline components
+    compile_cache_dir: str = Field(default="cache/compile")  # persisted Triton kernels, empty disables
     threaded: bool = Field(default=True)
+    device: str = Field(default="cuda")  # where decoded frames are uploaded, cpu for bench.py
+    status_file: str = Field(default="/tmp/gendj-status.json")  # read by the health check servers
+    stall_timeout: float = Field(default=5.0)  # seconds without a batch while frames wait before degraded
+    trace_sample_rate: float = Field(default=0)  # fraction of frames traced, 0 disables
+    trace_buffer: int = Field(default=100000)  # spans kept for /trace
+    record_file: str = Field(default=None)  # append frames and control events here, see replay.py
+
+    # queueing between pipeline stages
+    queue_policy: str = Field(default="drop_oldest")  # block, drop_oldest, drop_newest
+    batch_queue_size: int = Field(default=2)  # batches waiting for inference
+    frame_queue_size: int = Field(default=8)  # encoded frames waiting to be sent
+    max_frame_age: float = Field(default=0)  # seconds, 0 disables
+    decode_workers: int = Field(default=4)  # JPEG decode threads for ingest
+    encode_workers: int = Field(default=4)  # JPEG encode threads for output
 
     # parameters for inference
-    prompt: str = Field(default="A psychedelic landscape.")
+    prompt: Union[str, PromptBlend] = Field(default="A psychedelic landscape.")
+    blend_mode: str = Field(default="linear")  # linear or slerp
     num_inference_steps: int = Field(default=2)
     fixed_seed: bool = Field(default=True)
     seed: int = Field(default=0)
     batch_size: int = Field(default=4)
+    adaptive_batch: bool = Field(default=False)  # pick batch_size from the sizes below
+    adaptive_batch_sizes: str = Field(default="1,2,4")  # warmed at startup when adaptive
+    target_latency: float = Field(default=0.25)  # seconds, end to end
+    static_threshold: float = Field(default=0)  # mean frame difference (0-1) under which output is reused, 0 disables
+    static_refresh: float = Field(default=1.0)  # seconds between full inferences of a static scene
+    result_cache_mb: int = Field(default=0)  # encoded results kept for repeated inputs, 0 disables
+    max_batch_wait: float = Field(default=0)  # seconds before a partial batch is sent, 0 disables
     strength: float = Field(default=0.7)
     passthrough: bool = Field(default=False)
     compel: bool = Field(default=True)
+    embedding_cache_dir: str = Field(default="cache/embeddings")  # empty disables
+    prompt_setlist: str = Field(default=None)  # file with one prompt per line, embedded at startup
+    output_type: str = Field(default="uint8")  # uint8 quantizes on the GPU, np returns floats
 
     # can be changed dynamically
     opacity: float = Field(default=1.0)
@@ -43,3 +73,4 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
+        arbitrary_types_allowed = True
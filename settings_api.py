@@ -2,8 +2,9 @@ import threading
 import uvicorn
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.routing import APIRoute
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 import aiofiles
 import os
 
@@ -11,12 +12,31 @@ import time
 import json
 
 from safety_checker import SafetyChecker
+from prompt_blend import make_blend, make_mix, BLEND_MODES
+from prompt_embedder import PromptEmbedder
+from warmup_spec import WarmupSpec
+from readiness import READY
+from metrics import REGISTRY
+from tracing import TRACER
+from session_recorder import RecordingMiddleware
+
+# read-only endpoints, not recorded
+STATUS_PATHS = ("/readyz", "/status", "/metrics", "/trace")
 
 
 class SettingsAPI:
-    def __init__(self, settings):
+    def __init__(
+        self, settings, prompt_embedder=None, warmup=None, readiness=None, recorder=None
+    ):
         self.shutdown = False
         self.settings = settings
+        # an embedder that is never attached applies prompts right away
+        if prompt_embedder is None:
+            prompt_embedder = PromptEmbedder(settings)
+        self.prompt_embedder = prompt_embedder
+        self.warmup = warmup if warmup is not None else WarmupSpec.from_settings(settings)
+        self.readiness = readiness
+        self.recorder = recorder
         port = settings.settings_port
         self.thread = threading.Thread(target=self.run, args=(port,))
         self.prompt_0 = settings.prompt
@@ -24,15 +44,22 @@ class SettingsAPI:
         self.blend = 0
 
     def update_blend(self):
-        if self.blend == 0:
-            self.settings.prompt = self.prompt_0
-        elif self.blend == 1:
-            self.settings.prompt = self.prompt_1
-        else:
-            a = self.prompt_0
-            b = self.prompt_1
-            t = self.blend
-            self.settings.prompt = f'("{a}", "{b}").blend({1-t:.2f}, {t:.2f})'
+        self.prompt_embedder.submit(
+            make_blend(self.prompt_0, self.prompt_1, self.blend, self.settings.blend_mode)
+        )
+
+    # reply to a batch size or steps change with what each resolution being
+    # served really runs, snapped when any of them differs from the value sent
+    @staticmethod
+    def applied(runs, **sent):
+        resolutions = {
+            f"{height}x{width}": {"batch_size": batch_size, "steps": steps}
+            for (height, width), (batch_size, steps) in runs.items()
+        }
+        snapped = any(
+            run[name] != value for run in resolutions.values() for name, value in sent.items()
+        )
+        return {"status": "snapped" if snapped else "updated", "resolutions": resolutions}
 
     def start(self):
         print("SettingsAPI starting1212")
@@ -105,6 +132,45 @@ class SettingsAPI:
             except ValueError:
                 return {"status": "error", "message": "Invalid blend value"}
 
+        @app.post("/mix")
+        async def mix(request: Request):
+            # body: {"prompts": [...], "weights": [...], "mode": "linear" | "slerp"}
+            try:
+                body = await request.json()
+                prompts = [str(p) for p in body["prompts"]]
+                weights = [float(w) for w in body["weights"]]
+                mode = body.get("mode", self.settings.blend_mode)
+            except (ValueError, KeyError, TypeError):
+                return {"status": "error", "message": "Invalid mix"}
+            if any(w < 0 for w in weights):
+                return {"status": "error", "message": "Weights must not be negative"}
+
+            for i, prompt in enumerate(prompts):
+                override = "-f" in prompt
+                if override:
+                    prompt = prompts[i] = prompt.replace("-f", "").strip()
+                if self.settings.safety and not override:
+                    safety = safety_checker(prompt)
+                    if safety != "safe":
+                        print(f"Ignoring mix ({safety}):", prompt)
+                        return {"safety": "unsafe"}
+
+            try:
+                prompt = make_mix(prompts, weights, mode)
+            except ValueError as e:
+                return {"status": "error", "message": str(e)}
+            self.prompt_embedder.submit(prompt)
+            print("Updated mix:", prompt)
+            return {"status": "success", "safety": "safe"}
+
+        @app.get("/blend_mode/{mode}")
+        async def blend_mode(mode: str):
+            if mode not in BLEND_MODES:
+                return {"status": "error", "message": f"Blend mode must be one of {BLEND_MODES}"}
+            self.settings.blend_mode = mode
+            print("Updated blend_mode:", mode)
+            return {"status": "updated"}
+
         @app.get("/directory/{status}")
         async def directory(status: str):
             self.settings.directory = "data/" + status
@@ -143,9 +209,11 @@ class SettingsAPI:
 
         @app.get("/batch_size/{value}")
         async def batch_size(value: int):
-            self.settings.batch_size = value
-            print("Updated batch_size:", self.settings.batch_size)
-            return {"status": "updated"}
+            if value < 1:
+                return {"status": "error", "message": "batch_size must be at least 1"}
+            runs = self.warmup.apply(self.settings, batch_size=value)
+            print("Updated batch_size:", value)
+            return self.applied(runs, batch_size=value)
 
         @app.get("/seed/{value}")
         async def seed(value: int):
@@ -155,9 +223,11 @@ class SettingsAPI:
 
         @app.get("/steps/{value}")
         async def steps(value: int):
-            self.settings.num_inference_steps = value
-            print("Updated num_inference_steps:", self.settings.num_inference_steps)
-            return {"status": "updated"}
+            if value < 1:
+                return {"status": "error", "message": "steps must be at least 1"}
+            runs = self.warmup.apply(self.settings, steps=value)
+            print("Updated num_inference_steps:", value)
+            return self.applied(runs, steps=value)
 
         @app.get("/strength/{value}")
         async def strength(value: float):
@@ -172,6 +242,41 @@ class SettingsAPI:
             print("Updated opacity:", self.settings.opacity)
             return {"status": "updated"}
 
+        @app.get("/readyz")
+        async def readyz():
+            if self.readiness is None:
+                return {"state": READY}
+            state, problems = self.readiness.evaluate()
+            status_code = 200 if state == READY else 503
+            return JSONResponse({"state": state, "problems": problems}, status_code)
+
+        @app.get("/status")
+        async def status():
+            if self.readiness is None:
+                return {"state": READY}
+            return self.readiness.status()
+
+        @app.get("/metrics")
+        async def metrics():
+            return PlainTextResponse(
+                REGISTRY.exposition(), media_type="text/plain; version=0.0.4"
+            )
+
+        @app.get("/trace")
+        async def trace(seconds: float = 10):
+            # open in ui.perfetto.dev or chrome://tracing
+            return TRACER.chrome_trace(seconds)
+
+        if self.recorder is not None:
+            control_routes = [
+                route.path_regex
+                for route in app.routes
+                if isinstance(route, APIRoute) and route.path not in STATUS_PATHS
+            ]
+            app.add_middleware(
+                RecordingMiddleware, recorder=self.recorder, routes=control_routes
+            )
+
         if "READY_WEBHOOK_URL" not in os.environ:
             app.mount("/", StaticFiles(directory="fe", html=True), name="static")
 
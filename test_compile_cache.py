@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pytest
+
+from compile_cache import CompileCache
+
+VERSIONS = {"torch": "2.1.0", "diffusers": "0.24.0"}
+SHAPES = [[4, 512, 512, 3, 2]]
+CONFIG = {"enable_cuda_graph": True, "enable_triton": True}
+
+
+class FakeCompiler:
+    # stands in for sfast's compile(pipe, config=config)
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, pipe, config=None):
+        self.calls.append((pipe, config))
+        return ("compiled", pipe)
+
+
+@pytest.fixture(autouse=True)
+def compiler_env(monkeypatch):
+    # activate() points the compilers at the cache through the environment
+    monkeypatch.delenv("TRITON_CACHE_DIR", raising=False)
+    monkeypatch.delenv("TORCHINDUCTOR_CACHE_DIR", raising=False)
+
+
+def test_miss_record_hit(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    key = cache.key("model", CONFIG, SHAPES, VERSIONS)
+    compiler = FakeCompiler()
+
+    pipe, hit = cache.compile("pipe", compiler, CONFIG, key)
+    assert not hit
+    assert pipe == ("compiled", "pipe")
+    assert compiler.calls == [("pipe", CONFIG)]
+    assert os.environ["TRITON_CACHE_DIR"].startswith(cache.path(key))
+
+    cache.record(key, shapes=SHAPES)
+    # a new process reads the manifest from disk
+    pipe, hit = CompileCache(str(tmp_path)).compile("pipe", compiler, CONFIG, key)
+    assert hit
+    assert len(compiler.calls) == 2
+
+
+def test_key_changes_with_inputs(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    key = cache.key("model", CONFIG, SHAPES, VERSIONS)
+    assert key == cache.key("model", dict(CONFIG), [list(SHAPES[0])], dict(VERSIONS))
+    assert key != cache.key("other", CONFIG, SHAPES, VERSIONS)
+    assert key != cache.key("model", CONFIG, [[2, 512, 512, 3, 2]], VERSIONS)
+    assert key != cache.key("model", {**CONFIG, "enable_triton": False}, SHAPES, VERSIONS)
+    assert key != cache.key("model", CONFIG, SHAPES, {**VERSIONS, "torch": "2.2.0"})
+
+
+def test_missing_directory_is_a_miss(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    key = cache.key("model", CONFIG, SHAPES, VERSIONS)
+    cache.activate(key)
+    cache.record(key)
+    assert cache.lookup(key) is not None
+
+    shutil.rmtree(cache.path(key))
+    assert cache.lookup(key) is None
+    _, hit = cache.compile("pipe", FakeCompiler(), CONFIG, key)
+    assert not hit
+
+
+def test_record_keeps_other_workers_entries(tmp_path):
+    first = CompileCache(str(tmp_path))
+    second = CompileCache(str(tmp_path))  # loaded before first records anything
+    first.record("a")
+    second.record("b")
+    assert set(CompileCache(str(tmp_path)).manifest) == {"a", "b"}
@@ -2,15 +2,96 @@ import multiprocessing
 import threading
 import queue
 import time
+from ring_stats import WorkerStats
+
+
+class FrameQueue(queue.Queue):
+    # bounded queue with an overflow policy and an optional max age per item.
+    # policy is one of "block", "drop_oldest" or "drop_newest". items older
+    # than max_age seconds are discarded on get. None is always accepted so
+    # that close() can wake up a consumer even when the queue is full.
+    def __init__(self, maxsize=0, policy="block", max_age=None):
+        if policy not in ("block", "drop_oldest", "drop_newest"):
+            raise ValueError(f"Unknown queue policy: {policy}")
+        super().__init__(maxsize)
+        self.policy = policy
+        self.max_age = max_age
+        self.dropped_full = 0
+        self.dropped_stale = 0
+
+    def _put(self, item):
+        self.queue.append((time.time(), item))
+
+    def _get(self):
+        return self.queue.popleft()[1]
+
+    def put(self, item, block=True, timeout=None):
+        if item is not None and self.policy == "block":
+            return super().put(item, block, timeout)
+        with self.not_full:
+            full = 0 < self.maxsize <= self._qsize()
+            if item is not None and full:
+                self.dropped_full += 1
+                if self.policy == "drop_newest":
+                    return
+                self.queue.popleft()
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        if not self.max_age:
+            return super().get(block, timeout)
+        deadline = None if timeout is None else time.time() + timeout
+        with self.not_empty:
+            while True:
+                while not self._qsize():
+                    if not block:
+                        raise queue.Empty
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        raise queue.Empty
+                    self.not_empty.wait(remaining)
+                put_time, item = self.queue.popleft()
+                self.not_full.notify()
+                if item is None or time.time() - put_time <= self.max_age:
+                    return item
+                self.dropped_stale += 1
+                self.unfinished_tasks -= 1
+
+    @property
+    def dropped(self):
+        return self.dropped_full + self.dropped_stale
+
+    def stats(self):
+        return {
+            "size": self.qsize(),
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "dropped_full": self.dropped_full,
+            "dropped_stale": self.dropped_stale,
+        }
+
 
 class ThreadedWorker:
-    def __init__(self, has_input=True, has_output=True, mode="thread", debug=False):
+    def __init__(
+        self,
+        has_input=True,
+        has_output=True,
+        mode="thread",
+        debug=False,
+        queue_size=0,
+        queue_policy="block",
+        max_age=None,
+        stats_size=128,
+    ):
         if mode == "thread":
             self.ParallelClass = threading.Thread
-            self.QueueClass = queue.Queue
+            self.QueueClass = lambda: FrameQueue(queue_size, queue_policy, max_age)
         elif mode == "process":
             self.ParallelClass = multiprocessing.Process
-            self.QueueClass = multiprocessing.Queue
+            self.QueueClass = lambda: multiprocessing.Queue(queue_size)
         if has_input:
             self.input_queue = self.QueueClass()
         if has_output:
@@ -22,7 +103,7 @@ class ThreadedWorker:
         self.debug = debug
         self.last_print = time.time()
         self.print_interval = 1
-        self.durations = []
+        self.timings = WorkerStats(stats_size)
 
     def set_name(self, name):
         self.name = name
@@ -48,6 +129,41 @@ class ThreadedWorker:
         with self.input_queue.mutex:
             self.input_queue.queue.clear()
 
+    def queue_stats(self):
+        stats = {}
+        for name in ("input_queue", "output_queue"):
+            q = getattr(self, name, None)
+            if isinstance(q, FrameQueue):
+                stats[name] = q.stats()
+        return stats
+
+    def stats(self):
+        return self.timings.summary()
+
+    def format_stats(self):
+        busy = self.timings.busy.summary()
+        parts = [
+            f"{busy['mean']*1000:.2f}ms",
+            f"p95 {busy['p95']*1000:.2f}ms",
+            f"p99 {busy['p99']*1000:.2f}ms",
+            f"{self.timings.items_per_sec():.1f}/s",
+            f"busy {self.timings.utilization()*100:.0f}%",
+        ]
+        dropped = self.dropped_frames
+        if dropped:
+            parts.append(f"dropped {dropped}")
+        return " ".join(parts)
+
+    # frames dropped by this worker's output queue, i.e. produced but never consumed
+    @property
+    def dropped_frames(self):
+        q = getattr(self, "output_queue", None)
+        return q.dropped if isinstance(q, FrameQueue) else 0
+
+    # called when no input arrived within the poll timeout
+    def idle(self):
+        pass
+
     # called before the parallel is joined
     def cleanup(self):
         pass
@@ -56,6 +172,7 @@ class ThreadedWorker:
         print(self.name, "running")
         self.setup()
         try:
+            wait_start = time.time()
             while not self.should_exit:
                 cur_time = time.time()
                 if hasattr(self, "input_queue"):
@@ -64,26 +181,31 @@ class ThreadedWorker:
                         if input is None:
                             break
                         start_time = time.time()
+                        start_cpu = time.thread_time()
                         result = self.work(input)
                     except queue.Empty:
+                        self.idle()
                         continue
                 else:
                     start_time = time.time()
+                    start_cpu = time.thread_time()
                     result = self.work()
 
-                duration = time.time() - start_time
+                end_time = time.time()
+                cpu = time.thread_time() - start_cpu
 
                 if result is not None and hasattr(self, "output_queue"):
                     self.output_queue.put(result)
 
-                self.durations.append(duration)
-                if len(self.durations) > 10:
-                    self.durations.pop(0)
+                put_end = time.time()
+                self.timings.record(
+                    start_time - wait_start, end_time - start_time, cpu, put_end - end_time
+                )
+                wait_start = put_end
 
                 time_since_print = cur_time - self.last_print
                 if self.debug and time_since_print > self.print_interval:
-                    duration = sum(self.durations) / len(self.durations)
-                    print(self.name, f"{duration*1000:.2f}ms", flush=True)
+                    print(self.name, self.format_stats(), flush=True)
                     self.last_print = cur_time
 
         except KeyboardInterrupt:
@@ -98,4 +220,4 @@ class ThreadedWorker:
         if self.parallel.is_alive():
             self.parallel.join(timeout=5)  # Wait for up to 5 seconds
             if self.parallel.is_alive():
-                print(f"{self.name} failed to close in time")
\ No newline at end of file
+                print(f"{self.name} failed to close in time")
@@ -0,0 +1,93 @@
+from collections import deque
+from contextlib import contextmanager
+import itertools
+import os
+import random
+import threading
+import time
+
+
+class Tracer:
+    # per frame spans kept in a ring buffer and exported as Chrome trace
+    # json (chrome://tracing, ui.perfetto.dev). sample() decides once per
+    # frame, unsampled frames carry trace None and every call site skips
+    # them, so with sample_rate 0 tracing costs one comparison per frame.
+    # batch spans list the trace ids of the sampled frames they contain.
+    def __init__(self, sample_rate=0.0, capacity=100000):
+        self.sample_rate = sample_rate
+        self.spans = deque(maxlen=capacity)
+        self.ids = itertools.count(1)
+        self.thread_names = {}
+
+    def configure(self, sample_rate, capacity=None):
+        self.sample_rate = sample_rate
+        if capacity is not None and capacity != self.spans.maxlen:
+            self.spans = deque(self.spans, maxlen=capacity)
+
+    def sample(self):
+        if self.sample_rate <= 0:
+            return None
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        return next(self.ids)
+
+    def add(self, name, start, end, traces, **args):
+        # traces is one trace id or a list of them
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        self.spans.append(("X", name, start, end, tid, traces, args))
+
+    # a frame's whole lifetime, shown as an async track per frame
+    def add_frame(self, trace, start, end, **args):
+        self.spans.append(("async", "frame", start, end, None, trace, args))
+
+    @contextmanager
+    def span(self, name, traces, **args):
+        if not traces:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, start, time.time(), traces, **args)
+
+    def chrome_trace(self, seconds=None):
+        cutoff = None if seconds is None else time.time() - seconds
+        pid = os.getpid()
+        events = []
+        for tid, name in list(self.thread_names.items()):
+            events.append(
+                {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            )
+        for kind, name, start, end, tid, traces, args in list(self.spans):
+            if cutoff is not None and end < cutoff:
+                continue
+            args = dict(args)
+            if isinstance(traces, list):
+                args["traces"] = traces
+            else:
+                args["trace"] = traces
+            ts = start * 1e6
+            if kind == "async":
+                common = {"name": name, "cat": "frame", "pid": pid, "id": traces}
+                events.append({**common, "ph": "b", "ts": ts, "args": args})
+                events.append({**common, "ph": "e", "ts": end * 1e6})
+            else:
+                events.append(
+                    {
+                        "name": name,
+                        "cat": "stage",
+                        "ph": "X",
+                        "ts": ts,
+                        "dur": (end - start) * 1e6,
+                        "pid": pid,
+                        "tid": tid,
+                        "args": args,
+                    }
+                )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+TRACER = Tracer()
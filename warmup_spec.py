@@ -0,0 +1,165 @@
+from collections import namedtuple
+import threading
+from batch_controller import parse_batch_sizes
+
+WarmupShape = namedtuple("WarmupShape", "batch_size height width channels steps")
+
+
+def parse_shape(entry, steps=2):
+    # "BxHxWxC" with an optional "@steps" suffix
+    entry = entry.strip()
+    if "@" in entry:
+        entry, steps = entry.split("@", 1)
+    dims = [int(e) for e in entry.split("x")]
+    if len(dims) != 4:
+        raise ValueError(f"Warmup shape must be BxHxWxC, got {entry!r}")
+    return WarmupShape(*dims, int(steps))
+
+
+class WarmupSpec:
+    # the configurations compiled at startup plus the ones warmed later on
+    # request. runtime changes are snapped to the nearest warm configuration,
+    # a cold one is queued and warmed by the inference thread once no session
+    # is connected, so compiling never holds up a live stream.
+    def __init__(self, shapes=(), on_demand=True):
+        self.shapes = list(dict.fromkeys(shapes))  # warmed at startup, in order
+        self.on_demand = on_demand
+        self.warm = set()
+        self.pending = []
+        self.serving = None  # callable returning the (height, width) being served
+        self.version = 0  # bumped whenever a shape becomes warm
+        self.lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, value, steps=2, on_demand=True):
+        if not value:
+            return cls(on_demand=on_demand)
+        shapes = [parse_shape(e, steps) for e in value.split(",") if e.strip()]
+        return cls(shapes, on_demand)
+
+    @classmethod
+    def from_settings(cls, settings):
+        spec = cls.parse(
+            settings.warmup, settings.num_inference_steps, settings.warmup_on_demand
+        )
+        if settings.adaptive_batch and spec.shapes:
+            # every size the batch controller may switch to must be warm
+            for shape in list(spec.shapes):
+                for batch_size in parse_batch_sizes(settings.adaptive_batch_sizes):
+                    spec.add(shape._replace(batch_size=batch_size))
+        return spec
+
+    def add(self, shape):
+        if shape not in self.shapes:
+            self.shapes.append(shape)
+
+    def mark_warm(self, shape):
+        with self.lock:
+            self.warm.add(shape)
+            self.version += 1
+            if shape in self.pending:
+                self.pending.remove(shape)
+
+    def discard(self, shape):
+        with self.lock:
+            if shape in self.pending:
+                self.pending.remove(shape)
+
+    def available(self):
+        # startup shapes count as warm, nothing is served before they are
+        with self.lock:
+            return set(self.shapes) | self.warm
+
+    # warm batch sizes, only those warm at this resolution if one is given
+    def batch_sizes(self, height=None, width=None):
+        return sorted(
+            {
+                shape.batch_size
+                for shape in self.available()
+                if height is None or (shape.height, shape.width) == (height, width)
+            }
+        )
+
+    # largest batch size up to batch_size that is warm at this resolution,
+    # the smallest warm one if all are larger
+    def batch_size_for(self, batch_size, height, width):
+        sizes = self.batch_sizes(height, width)
+        if not sizes:
+            return batch_size
+        fitting = [size for size in sizes if size <= batch_size]
+        return fitting[-1] if fitting else sizes[0]
+
+    def nearest(self, batch_size=None, height=None, width=None, steps=None):
+        # resolution matters most since resizing is visible, a matching aspect
+        # ratio first since anything else gets cropped, then steps
+        shapes = self.available()
+        if not shapes:
+            return None
+
+        def distance(shape):
+            return (
+                height is not None and shape.height * width != height * shape.width,
+                0 if height is None else abs(shape.height * shape.width - height * width),
+                0 if steps is None else abs(shape.steps - steps),
+                0 if batch_size is None else abs(shape.batch_size - batch_size),
+                shape,
+            )
+
+        return min(shapes, key=distance)
+
+    # nearest warm step count for a batch of this shape
+    def snap_steps(self, steps, batch_size, height, width):
+        warm = [
+            shape.steps
+            for shape in self.available()
+            if (shape.batch_size, shape.height, shape.width) == (batch_size, height, width)
+        ]
+        if not warm:
+            return steps
+        return min(warm, key=lambda e: (abs(e - steps), e))
+
+    def request(self, batch_size=None, height=None, width=None, steps=None):
+        # returns the warm shape to use now, queueing the exact one if it is cold
+        snapped = self.nearest(batch_size, height, width, steps)
+        if snapped is None:
+            return None
+        fields = dict(batch_size=batch_size, height=height, width=width, steps=steps)
+        wanted = snapped._replace(**{k: v for k, v in fields.items() if v is not None})
+        with self.lock:
+            if wanted == snapped or not self.on_demand:
+                return snapped
+            if wanted not in self.pending:
+                self.pending.append(wanted)
+        print(f"Warmup queued for {format_shape(wanted)}, using {format_shape(snapped)}")
+        return snapped
+
+    # sets a batch size or step count change on settings, which keep the value
+    # asked for while every batch is snapped to a shape warm at its resolution.
+    # returns {(height, width): (batch_size, steps)} each resolution being
+    # served will really run, cold shapes at those resolutions are queued.
+    # with nobody connected it reports every warm resolution and queues nothing
+    def apply(self, settings, batch_size=None, steps=None):
+        if batch_size is not None:
+            settings.batch_size = batch_size
+        if steps is not None:
+            settings.num_inference_steps = steps
+        batch_size, steps = settings.batch_size, settings.num_inference_steps
+        served = set(self.serving()) if self.serving is not None else set()
+        resolutions = served or {(e.height, e.width) for e in self.available()}
+        runs = {}
+        for height, width in sorted(resolutions):
+            if (height, width) in served:
+                self.request(batch_size, height, width, steps)
+            run_batch_size = self.batch_size_for(batch_size, height, width)
+            run_steps = self.snap_steps(steps, run_batch_size, height, width)
+            runs[(height, width)] = (run_batch_size, run_steps)
+        return runs
+
+    def next_pending(self):
+        with self.lock:
+            return self.pending[0] if self.pending else None
+
+
+def format_shape(shape):
+    dims = (shape.batch_size, shape.height, shape.width, shape.channels)
+    return "x".join(str(e) for e in dims) + f"@{shape.steps}"